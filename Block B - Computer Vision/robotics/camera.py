@@ -0,0 +1,104 @@
+import numpy as np
+import pybullet as p
+
+# the camera Simulation used to render every step with rgb_array=True
+DEFAULT_CAMERA_POSITION = [1, 0, 1]
+DEFAULT_CAMERA_TARGET = [-0.3, 0, 0]
+DEFAULT_UP_VECTOR = [0, 0, 1]
+
+
+class OffscreenCamera:
+    """
+    Offscreen camera for a Simulation.
+    The view and projection matrices are computed once, frames are rendered every render_every
+    calls to tick (0 renders only when capture is called) and written into preallocated uint8
+    ring buffers, optionally together with the depth buffer and the segmentation mask.
+    """
+    def __init__(self, client, width=320, height=240, camera_position=DEFAULT_CAMERA_POSITION,
+                 camera_target=DEFAULT_CAMERA_TARGET, up_vector=DEFAULT_UP_VECTOR, fov=50, near=0.1, far=100.0,
+                 render_every=1, buffer_size=8, depth=False, segmentation=False, renderer=None):
+        if render_every < 0:
+            raise ValueError(f"render_every must be 0 or positive, got {render_every}")
+        if buffer_size < 1:
+            raise ValueError(f"buffer_size must be at least 1, got {buffer_size}")
+        self._p = client
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.near = near
+        self.far = far
+        self.render_every = render_every
+        self.buffer_size = buffer_size
+        self.depth = depth
+        self.segmentation = segmentation
+        # the segmentation mask is skipped by the renderer when it is not asked for
+        self._flags = 0 if segmentation else p.ER_NO_SEGMENTATION_MASK
+        self._renderer = {} if renderer is None else {"renderer": renderer}
+        self.set_view(camera_position, camera_target, up_vector)
+        self.projection_matrix = self._p.computeProjectionMatrixFOV(fov, width / height, near, far)
+
+        # ring buffers, frame k of the run lives in slot k % buffer_size
+        self.rgb_frames = np.zeros((buffer_size, height, width, 3), dtype=np.uint8)
+        self.depth_frames = np.zeros((buffer_size, height, width), dtype=np.float32) if depth else None
+        self.segmentation_frames = np.zeros((buffer_size, height, width), dtype=np.int32) if segmentation else None
+        self.frame_count = 0
+        self._ticks = 0
+
+    # method to move the camera, the only time the view matrix is recomputed
+    def set_view(self, camera_position, camera_target, up_vector=DEFAULT_UP_VECTOR):
+        self.camera_position = list(camera_position)
+        self.camera_target = list(camera_target)
+        self.up_vector = list(up_vector)
+        self.view_matrix = self._p.computeViewMatrix(self.camera_position, self.camera_target, self.up_vector)
+
+    # method called by the simulation on every sensor tick, renders every render_every ticks
+    def tick(self):
+        self._ticks += 1
+        if self.render_every and self._ticks % self.render_every == 0:
+            self.capture()
+
+    # method to render a frame now, returns the rgb frame in the ring buffer
+    def capture(self):
+        _, _, rgb, depth, segmentation = self._p.getCameraImage(
+            width=self.width, height=self.height, viewMatrix=self.view_matrix,
+            projectionMatrix=self.projection_matrix, flags=self._flags, **self._renderer)
+        slot = self.frame_count % self.buffer_size
+        # pybullet returns arrays when it is built with numpy and flat lists otherwise
+        np.copyto(self.rgb_frames[slot], np.reshape(rgb, (self.height, self.width, 4))[:, :, :3], casting='unsafe')
+        if self.depth:
+            np.copyto(self.depth_frames[slot], np.reshape(depth, (self.height, self.width)), casting='unsafe')
+        if self.segmentation:
+            np.copyto(self.segmentation_frames[slot], np.reshape(segmentation, (self.height, self.width)), casting='unsafe')
+        self.frame_count += 1
+        return self.rgb_frames[slot]
+
+    # method to get the ring buffer slot of the newest frame, None before the first frame
+    def _latest_slot(self):
+        if self.frame_count == 0:
+            return None
+        return (self.frame_count - 1) % self.buffer_size
+
+    def latest_frame(self):
+        """Returns a view of the newest rgb frame, it is overwritten once the ring buffer wraps around."""
+        slot = self._latest_slot()
+        return None if slot is None else self.rgb_frames[slot]
+
+    def latest_depth(self):
+        slot = self._latest_slot()
+        return None if slot is None or not self.depth else self.depth_frames[slot]
+
+    def latest_segmentation(self):
+        slot = self._latest_slot()
+        return None if slot is None or not self.segmentation else self.segmentation_frames[slot]
+
+    def recent_frames(self, count=None):
+        """Returns a copy of the last count rgb frames (all buffered frames by default), oldest first."""
+        available = min(self.frame_count, self.buffer_size)
+        count = available if count is None else min(count, available)
+        slots = [(self.frame_count - count + k) % self.buffer_size for k in range(count)]
+        return self.rgb_frames[slots]
+
+    # method to forget the buffered frames, the buffers themselves are kept
+    def clear(self):
+        self.frame_count = 0
+        self._ticks = 0
@@ -0,0 +1,135 @@
+import numpy as np
+
+# one record per droplet that landed on a specimen or hit a robot, robot and specimen are pybullet body ids (-1 for none)
+DROPLET_DTYPE = np.dtype([
+    ('specimen', np.int32),
+    ('robot', np.int32),
+    ('step', np.int64),
+    ('position', np.float64, 3),
+    ('state', np.int8),
+])
+
+
+def _nearest(points, queries):
+    """Returns the distance to and index of the nearest of points for every query, with a KD-tree when scipy is installed."""
+    queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return np.full(len(queries), np.inf), np.full(len(queries), -1)
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        # brute force in blocks of queries, which keeps the distance matrix small
+        distances = np.empty(len(queries))
+        indices = np.empty(len(queries), dtype=np.int64)
+        block = max(1, 2 ** 20 // len(points))
+        for start in range(0, len(queries), block):
+            squared = ((queries[start:start + block, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+            indices[start:start + block] = squared.argmin(axis=1)
+            distances[start:start + block] = np.sqrt(squared[np.arange(len(squared)), indices[start:start + block]])
+        return distances, indices
+    return cKDTree(points).query(queries)
+
+
+class DropletLog:
+    """
+    Growable structured array of the droplets of a Simulation, one DROPLET_DTYPE record per droplet.
+    Records are appended as droplets land or hit a robot, the array doubles when it is full so that
+    appending stays cheap with many thousands of droplets. Scoring drops against targets is a single
+    nearest neighbour query over the positions instead of a loop over tuples.
+    """
+    def __init__(self, capacity=256):
+        self._records = np.zeros(capacity, dtype=DROPLET_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    # method to add a droplet record
+    def append(self, specimenId, robotId, step, position, state):
+        if self._size == len(self._records):
+            grown = np.zeros(2 * len(self._records), dtype=DROPLET_DTYPE)
+            grown[:self._size] = self._records[:self._size]
+            self._records = grown
+        self._records[self._size] = (specimenId, robotId, step, position, state)
+        self._size += 1
+
+    def clear(self):
+        self._size = 0
+
+    def copy(self):
+        log = DropletLog(max(1, len(self._records)))
+        log._records[:self._size] = self._records[:self._size]
+        log._size = self._size
+        return log
+
+    # the records so far, a view that is only valid until the next append
+    @property
+    def records(self):
+        return self._records[:self._size]
+
+    # method to select the records of one specimen and/or one state, None selects all
+    def _mask(self, specimenId, state):
+        records = self.records
+        mask = np.ones(len(records), dtype=bool)
+        if specimenId is not None:
+            mask &= records['specimen'] == specimenId
+        if state is not None:
+            mask &= records['state'] == state
+        return mask
+
+    # method to get the records of one specimen, and optionally only those in one state
+    def for_specimen(self, specimenId, state=None):
+        return self.records[self._mask(specimenId, state)]
+
+    # method to get the (n,3) droplet positions, of one specimen and/or one state if given
+    def positions(self, specimenId=None, state=None):
+        return self.records['position'][self._mask(specimenId, state)]
+
+    # method to find the nearest droplet to every point, returns the distances and record indices (-1 without droplets)
+    def nearest_droplets(self, points, specimenId=None, state=None):
+        indices = np.flatnonzero(self._mask(specimenId, state))
+        distances, nearest = _nearest(self.records['position'][indices], points)
+        if len(indices) == 0:
+            return distances, nearest
+        return distances, indices[nearest]
+
+    # method to score droplets against targets, returns the distance from every selected droplet to its nearest target and that target's index
+    def distance_to_targets(self, targets, specimenId=None, state=None):
+        return _nearest(np.asarray(targets, dtype=np.float64).reshape(-1, 3), self.positions(specimenId, state))
+
+    # method to get the legacy {'specimenId_<id>': [(x, y, z), ...]} dictionary of the records in one state
+    def as_dict(self, state):
+        droplet_positions = {}
+        for record in self.records[self._mask(None, state)]:
+            droplet_positions.setdefault(f"specimenId_{record['specimen']}", []).append(tuple(record['position'].tolist()))
+        return droplet_positions
+
+    # method to write the records to a compressed .npz file, one array per column
+    def to_npz(self, path):
+        records = self.records
+        np.savez_compressed(path, **{name: records[name] for name in DROPLET_DTYPE.names})
+
+    # method to load records written by to_npz
+    @classmethod
+    def from_npz(cls, path):
+        with np.load(path) as columns:
+            log = cls(max(1, len(columns['step'])))
+            for name in DROPLET_DTYPE.names:
+                log._records[name][:len(columns[name])] = columns[name]
+            log._size = len(columns['step'])
+        return log
+
+    # method to write the records to a parquet file, needs pandas with pyarrow or fastparquet
+    def to_parquet(self, path):
+        import pandas as pd
+        records = self.records
+        frame = pd.DataFrame({
+            'specimen': records['specimen'],
+            'robot': records['robot'],
+            'step': records['step'],
+            'x': records['position'][:, 0],
+            'y': records['position'][:, 1],
+            'z': records['position'][:, 2],
+            'state': records['state'],
+        })
+        frame.to_parquet(path, index=False)
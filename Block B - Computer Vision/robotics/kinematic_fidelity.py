@@ -0,0 +1,82 @@
+import argparse
+import time
+import numpy as np
+
+from sim_class import Simulation
+from kinematic_sim import KinematicSimulation
+
+
+def random_action_sequence(rng, num_agents, num_steps, hold_steps):
+    """Piecewise constant velocity commands in [-1, 1], a new command every hold_steps steps."""
+    num_segments = -(-num_steps // hold_steps)
+    segments = rng.uniform(-1, 1, size=(num_segments, num_agents, 3))
+    actions = np.zeros((num_steps, num_agents, 4))
+    actions[:, :, :3] = np.repeat(segments, hold_steps, axis=0)[:num_steps]
+    return actions
+
+
+def rollout(sim, actions):
+    """Runs the action sequence and returns the pipette trajectory (steps, agents, 3) and the wall time."""
+    trajectory = np.zeros((len(actions), actions.shape[1], 3))
+    start = time.perf_counter()
+    for t, action in enumerate(actions):
+        _, _, pipette_positions = sim.run_array(action)
+        trajectory[t] = pipette_positions
+    return trajectory, time.perf_counter() - start
+
+
+def fidelity_report(num_agents=4, num_steps=2000, hold_steps=120, seed=0):
+    """Compares the kinematic backend against PyBullet on the same random velocity commands."""
+    actions = random_action_sequence(np.random.default_rng(seed), num_agents, num_steps, hold_steps)
+
+    pybullet_sim = Simulation(num_agents=num_agents, render=False)
+    reference, pybullet_time = rollout(pybullet_sim, actions)
+    pybullet_sim.close()
+
+    kinematic_sim = KinematicSimulation(num_agents=num_agents)
+    trajectory, kinematic_time = rollout(kinematic_sim, actions)
+
+    error = np.abs(trajectory - reference)
+    return {
+        "num_agents": num_agents,
+        "num_steps": num_steps,
+        "rms_error_mm": np.sqrt((error ** 2).mean(axis=(0, 1))) * 1000,
+        "max_error_mm": error.max(axis=(0, 1)) * 1000,
+        "final_error_mm": np.linalg.norm(trajectory[-1] - reference[-1], axis=1).mean() * 1000,
+        "pybullet_steps_per_second": num_steps / pybullet_time,
+        "kinematic_steps_per_second": num_steps / kinematic_time,
+    }
+
+
+def main(args):
+    report = fidelity_report(args.num_agents, args.num_steps, args.hold_steps, args.seed)
+    print("--- Kinematic backend fidelity against PyBullet ---")
+    print(f"Agents: {report['num_agents']}, steps: {report['num_steps']}")
+    print(f"RMS pipette error per axis (mm): {np.round(report['rms_error_mm'], 3)}")
+    print(f"Max pipette error per axis (mm): {np.round(report['max_error_mm'], 3)}")
+    print(f"Mean final position error (mm): {report['final_error_mm']:.3f}")
+    print(f"PyBullet: {report['pybullet_steps_per_second']:.0f} steps/s, "
+          f"kinematic: {report['kinematic_steps_per_second']:.0f} steps/s "
+          f"({report['kinematic_steps_per_second'] / report['pybullet_steps_per_second']:.0f}x)")
+
+    # step rate of the kinematic backend alone for a large batch of robots
+    if args.scale_agents:
+        kinematic_sim = KinematicSimulation(num_agents=args.scale_agents)
+        actions = np.zeros((args.scale_agents, 4))
+        actions[:, :3] = 0.5
+        start = time.perf_counter()
+        kinematic_sim.run_array(actions, num_steps=1000)
+        elapsed = time.perf_counter() - start
+        print(f"Kinematic backend with {args.scale_agents} robots: {1000 / elapsed:.0f} steps/s "
+              f"({1000 * args.scale_agents / elapsed:.0f} robot-steps/s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_agents", type=int, default=4)
+    parser.add_argument("--num_steps", type=int, default=2000)
+    parser.add_argument("--hold_steps", type=int, default=120, help="Steps each random velocity command is held")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale_agents", type=int, default=4096, help="Robots for the kinematic-only step rate, 0 to skip")
+    args = parser.parse_args()
+    main(args)
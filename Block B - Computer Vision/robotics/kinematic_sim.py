@@ -0,0 +1,284 @@
+import csv
+import math
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from sim_class import JOINT_SIGNS, DROPLET_RADIUS, DROPLET_SETTLED, PHYSICS_HZ
+from droplet_log import DropletLog
+from world_state import WorldState
+
+# the working envelope measured with task9_test_2.py, pipette positions of a robot placed at the origin
+ENVELOPE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'working_envelope.csv')
+ROBOT_URDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ot_2_simulation_v6.urdf')
+
+# layout constants shared with sim_class.Simulation
+PIPETTE_OFFSET = np.array([0.073, 0.0895, 0.0895])
+BASE_HEIGHT = 0.03
+SPECIMEN_OFFSET = np.array([0.18275-0.00005, 0.163-0.026, 0.057])
+SPECIMEN_HALF_SIZE = 0.075
+SPECIMEN_HALF_THICKNESS = 0.0075
+
+# actuator model fitted against the PyBullet robot, see kinematic_fidelity.py
+DEFAULT_TAU = 1./240.
+DEFAULT_MAX_ACCELERATION = np.array([26.0, 32.0, 55.0])
+LIMIT_ENGAGE_DISTANCE = 0.039
+LIMIT_PULL = 0.2
+
+
+def load_envelope(path=ENVELOPE_PATH):
+    """Returns the (low, high) pipette bounds of the working envelope csv."""
+    with open(path, newline='') as csvfile:
+        corners = np.array([[float(row['X']), float(row['Y']), float(row['Z'])] for row in csv.DictReader(csvfile)])
+    return corners.min(axis=0), corners.max(axis=0)
+
+
+def load_joint_limits(path=ROBOT_URDF_PATH):
+    """Returns the (lower, upper) limits of the prismatic joints in the robot urdf, in joint order."""
+    joints = [joint for joint in ET.parse(path).getroot().iter('joint') if joint.get('type') == 'prismatic']
+    limits = np.array([[float(joint.find('limit').get('lower')), float(joint.find('limit').get('upper'))] for joint in joints])
+    return limits[:, 0], limits[:, 1]
+
+
+class KinematicSimulation:
+    """
+    Physics-free drop-in for sim_class.Simulation.
+    The pipette position of the OT-2 is the base position plus the three prismatic joint positions plus
+    the pipette offset, so the gantry is integrated directly: each joint follows its velocity command
+    through a first-order lag with an acceleration limit and is clamped to the working envelope.
+    Like PyBullet's limit constraint, a joint outside its urdf limit can move back towards the limit
+    but not further away (the z joint starts below its lower limit).
+    Everything is vectorized over the robots with NumPy, droplets land straight down on the specimen.
+
+    It covers the interface the environments and rollouts use: run, run_array and run_until with the same
+    control ticks, the states, drops, joint_limits and capture_state/restore_state. There is no camera,
+    contact checking, profiler or step callbacks, so sensor_hz, physics_preset and the texture and camera
+    options of Simulation are not taken, and get_plate_image returns plate_image_path for every specimen.
+    """
+    def __init__(self, num_agents, render=False, rgb_array=False, physics_hz=PHYSICS_HZ, control_hz=None, tau=DEFAULT_TAU,
+                 max_acceleration=DEFAULT_MAX_ACCELERATION, envelope_path=ENVELOPE_PATH):
+        self.render = render
+        self.rgb_array = rgb_array
+        self.physics_hz = physics_hz
+        self.control_hz = control_hz or physics_hz
+        control_interval = physics_hz / self.control_hz
+        if self.control_hz <= 0 or self.control_hz > physics_hz or control_interval != int(control_interval):
+            raise ValueError(f"control_hz must divide physics_hz ({physics_hz}), got {self.control_hz}")
+        # number of physics substeps between two control updates
+        self.control_interval = int(control_interval)
+        self.time_step = 1. / physics_hz
+        # physics steps taken since the simulation was created, the control ticks are counted from here
+        self.physics_step = 0
+        # counts the worlds built by create_robots, as Simulation does for its states
+        self._generation = 0
+        self.tau = tau
+        self.max_acceleration = np.asarray(max_acceleration, dtype=np.float64)
+        self.pipette_offset = list(PIPETTE_OFFSET)
+        self.envelope_low, self.envelope_high = load_envelope(envelope_path)
+        self.plate_image_path = None
+        self.physicsClient = -1
+        self.create_robots(num_agents)
+
+    # method to create n robots in the same grid pattern as Simulation
+    def create_robots(self, num_agents):
+        spacing = 1
+        grid_size = math.ceil(num_agents ** 0.5)
+        cells = [(i, j) for i in range(grid_size) for j in range(grid_size)][:num_agents]
+        self.base_position_array = np.array([[-spacing * i, -spacing * j, BASE_HEIGHT] for i, j in cells]).reshape(-1, 3)
+        # same ids as PyBullet hands out, plane 0 then a robot and its specimen per agent
+        self.robotIds = [1 + 2 * k for k in range(num_agents)]
+        self.specimenIds = [2 + 2 * k for k in range(num_agents)]
+        self.specimen_position_array = self.base_position_array + SPECIMEN_OFFSET
+
+        self.joint_position_array = np.zeros((num_agents, 3))
+        self.joint_velocity_array = np.zeros((num_agents, 3))
+        self.pipette_position_array = np.zeros((num_agents, 3))
+        self._target_velocities = np.zeros((num_agents, 3))
+        self.pipette_origin_array = self.base_position_array + PIPETTE_OFFSET
+
+        # joint limits that keep the pipette inside the envelope, the x and y joints move the pipette in the negative direction
+        origin = np.array([0, 0, BASE_HEIGHT]) + PIPETTE_OFFSET
+        limits = np.stack(((self.envelope_low - origin) * JOINT_SIGNS, (self.envelope_high - origin) * JOINT_SIGNS))
+        self.joint_lower = limits.min(axis=0)
+        self.joint_upper = limits.max(axis=0)
+        self.urdf_joint_lower, self.urdf_joint_upper = load_joint_limits()
+
+        self.pipette_positions = {f'robotId_{robotId}': list(position) for robotId, position in zip(self.robotIds, self.pipette_origin_array)}
+        self.droplet_log = DropletLog()
+        self.sphereIds = []
+        self._generation += 1
+
+    def reset(self, num_agents=1):
+        if num_agents != len(self.robotIds):
+            self.create_robots(num_agents)
+        else:
+            self.joint_position_array[:] = 0
+            self.joint_velocity_array[:] = 0
+            self._target_velocities[:] = 0
+            self.droplet_log.clear()
+        return self.get_states()
+
+    def reset_robot(self, index):
+        self.joint_position_array[index] = 0
+        self.joint_velocity_array[index] = 0
+        self._target_velocities[index] = 0
+
+    def run(self, actions, num_steps=1):
+        self.run_array(actions, num_steps)
+        return self.get_states()
+
+    # the actions are applied on the first step and re-applied on every control tick like Simulation, a held drop command drops once per tick
+    def run_array(self, actions, num_steps=1):
+        actions = np.asarray(actions, dtype=np.float64)
+        for i in range(num_steps):
+            if i == 0 or self.physics_step % self.control_interval == 0:
+                self.apply_actions_array(actions)
+            self._integrate()
+        return self.get_state_arrays()
+
+    # method to hold one (N,4) array of actions until the pipettes reach target, the joints come to rest or max_steps have run,
+    # with the same arguments and return values as Simulation.run_until
+    def run_until(self, actions, target=None, tolerance=0.001, velocity_epsilon=None, max_steps=1000):
+        if max_steps < 1:
+            raise ValueError(f"max_steps must be at least 1, got {max_steps}")
+        num_agents = len(self.robotIds)
+        actions = np.asarray(actions, dtype=np.float64).reshape(num_agents, 4)
+        if target is not None:
+            target = np.broadcast_to(np.asarray(target, dtype=np.float64), (num_agents, 3))
+        trajectory = np.empty((max_steps, num_agents, 3))
+
+        self.apply_actions_array(actions)
+        for step in range(max_steps):
+            self._integrate()
+            _, joint_velocities, pipette_positions = self.get_state_arrays()
+            trajectory[step] = pipette_positions
+            if target is not None and (np.linalg.norm(pipette_positions - target, axis=1) <= tolerance).all():
+                break
+            if velocity_epsilon is not None and (np.abs(joint_velocities) < velocity_epsilon).all():
+                break
+        return self.get_states(), trajectory[:step + 1]
+
+    def apply_actions(self, actions):
+        self.apply_actions_array(np.asarray(actions, dtype=np.float64))
+
+    def apply_actions_array(self, actions):
+        np.multiply(actions[:, :3], JOINT_SIGNS, out=self._target_velocities)
+        drop_indices = np.flatnonzero(actions[:, 3] == 1)
+        if len(drop_indices):
+            self.drop_many([self.robotIds[i] for i in drop_indices])
+
+    # method to advance all joints by one time step
+    def _integrate(self):
+        dt = self.time_step
+        # first-order lag towards the commanded velocity, limited by the acceleration the motors can deliver
+        alpha = 1.0 - math.exp(-dt / self.tau) if self.tau > 0 else 1.0
+        dv = (self._target_velocities - self.joint_velocity_array) * alpha
+        max_dv = self.max_acceleration * dt
+        np.clip(dv, -max_dv, max_dv, out=dv)
+        self.joint_velocity_array += dv
+        previous_positions = self.joint_position_array.copy()
+        self.joint_position_array += self.joint_velocity_array * dt
+
+        # PyBullet engages the limit of a joint below its lower limit once it is within LIMIT_ENGAGE_DISTANCE of it,
+        # then pulls the joint in by a fraction of the gap every step
+        engaged = (previous_positions < self.urdf_joint_lower) & (previous_positions > self.urdf_joint_lower - LIMIT_ENGAGE_DISTANCE)
+        self.joint_position_array[engaged] += LIMIT_PULL * (self.urdf_joint_lower - previous_positions)[engaged]
+
+        # a joint that hits its limit stops there, outside its urdf limit it may only move back towards it
+        lower = np.maximum(np.minimum(self.urdf_joint_lower, previous_positions), self.joint_lower)
+        upper = np.minimum(np.maximum(self.urdf_joint_upper, previous_positions), self.joint_upper)
+        stopped = (self.joint_position_array < lower) | (self.joint_position_array > upper)
+        np.clip(self.joint_position_array, lower, upper, out=self.joint_position_array)
+        self.joint_velocity_array[stopped] = 0
+        self.physics_step += 1
+
+    def get_state_arrays(self):
+        np.multiply(self.joint_position_array, JOINT_SIGNS, out=self.pipette_position_array)
+        self.pipette_position_array += self.pipette_origin_array
+        return self.joint_position_array, self.joint_velocity_array, self.pipette_position_array
+
+    def get_states(self):
+        _, _, pipette_positions = self.get_state_arrays()
+        states = {}
+        for k, robotId in enumerate(self.robotIds):
+            joint_states = {f'joint_{i}': {'position': float(self.joint_position_array[k, i]),
+                                           'velocity': float(self.joint_velocity_array[k, i]),
+                                           'reaction_forces': (0.0, 0.0, 0.0, 0.0, 0.0, 0.0),
+                                           'motor_torque': 0.0} for i in range(3)}
+            robot_position = list(pipette_positions[k] - PIPETTE_OFFSET)
+            states[f'robotId_{robotId}'] = {
+                "joint_states": joint_states,
+                "robot_position": robot_position,
+                "pipette_position": [round(float(num), 4) for num in pipette_positions[k]]
+            }
+        return states
+
+    # method to get the (3,) lower and upper limits of the x, y and z joints from the robot urdf
+    def joint_limits(self):
+        return self.urdf_joint_lower.copy(), self.urdf_joint_upper.copy()
+
+    def get_pipette_position(self, robotId):
+        k = self.robotIds.index(robotId)
+        return list(self.pipette_origin_array[k] + self.joint_position_array[k] * JOINT_SIGNS)
+
+    def drop(self, robotId):
+        return self.drop_many([robotId])[0]
+
+    # droplets fall straight down and land on the specimen of the robot if the pipette is above it
+    def drop_many(self, robotIds):
+        indices = [self.robotIds.index(robotId) for robotId in robotIds]
+        _, _, pipette_positions = self.get_state_arrays()
+        droplet_positions = []
+        for k in indices:
+            droplet_position = pipette_positions[k] - [0, 0, 0.0015]
+            droplet_positions.append(list(droplet_position))
+            specimen_position = self.specimen_position_array[k]
+            if np.all(np.abs(droplet_position[:2] - specimen_position[:2]) <= SPECIMEN_HALF_SIZE):
+                landing_position = (droplet_position[0], droplet_position[1],
+                                    specimen_position[2] + SPECIMEN_HALF_THICKNESS + DROPLET_RADIUS)
+                self.droplet_log.append(self.specimenIds[k], self.robotIds[k], self.physics_step, landing_position, DROPLET_SETTLED)
+        return droplet_positions
+
+    @property
+    def droplet_positions(self):
+        return self.droplet_log.as_dict(DROPLET_SETTLED)
+
+    def set_start_position(self, x, y, z):
+        target = np.array([x, y, z])
+        self.joint_position_array[:] = (target - self.pipette_origin_array) * JOINT_SIGNS
+        self.joint_velocity_array[:] = 0
+
+    # method to capture the robots and the droplet log into a WorldState, the state is plain arrays so exact changes nothing
+    def capture_state(self, exact=False):
+        return WorldState(len(self.robotIds), self._generation, self.physics_step,
+                          self.joint_position_array.copy(), self.joint_velocity_array.copy(), self._target_velocities.copy(),
+                          [], self.droplet_log.copy())
+
+    # method to bring the robots and the droplet log back to a captured WorldState
+    # droplets land the moment they are dropped, so the droplets still falling in a state captured by Simulation are left out
+    def restore_state(self, state):
+        if state.num_agents != len(self.robotIds):
+            raise ValueError(f"state has {state.num_agents} agents, the simulation has {len(self.robotIds)}")
+        self.joint_position_array[:] = state.joint_positions
+        self.joint_velocity_array[:] = state.joint_velocities
+        self._target_velocities[:] = state.target_velocities
+        self.droplet_log = state.droplet_log.copy()
+        self.physics_step = state.physics_step
+        return self.get_states()
+
+    # there is no pybullet copy to free
+    def discard_state(self, state):
+        state.bullet_state_id = None
+
+    # there are no textures, every specimen shows plate_image_path
+    def get_plate_image(self, specimenId=None):
+        return self.plate_image_path
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -3,28 +3,67 @@ from gymnasium import spaces
 import numpy as np
 from sim_class import Simulation
 
+# working envelope of the pipette, the goals are drawn from it
+ENVELOPE_LOW = np.array([-0.1874, -0.1711, 0.1195])
+ENVELOPE_HIGH = np.array([0.253, 0.2202, 0.2902])
+
 class OT2Env(gym.Env):
     """
     This is the advanced environment wrapper for the OT-2 simulation.
     It includes customizable reward parameters for more effective training.
+    A step writes into preallocated action, position and observation buffers and reads the pipette
+    position from the simulation's state arrays, so it allocates nothing beyond the returned observation.
+    With reuse_observation=True the observation buffer itself is returned and overwritten by the next step or reset.
+
+    reset_mode='goal' keeps the robot where the last episode left it and only draws a new goal, instead of
+    restoring the world on every reset. With num_targets > 1 an episode chains goals the way pipeline.py visits
+    root tips, sorted by x: reaching a goal pays the bonus and moves on to the next, and the episode terminates
+    once the last one is reached. max_steps bounds the whole episode. reset(options={'targets': ...}) replaces
+    the drawn goals with given ones, options={'full_reset': True} restores the world in goal mode.
+
+    The z joint starts below its urdf lower limit and the pipette can not get back below z_floor once it has
+    moved up. Only the first goal of an episode that starts from a restored world (every episode in full mode,
+    the first one in goal mode) may lie anywhere in the envelope, it is reached on the way up from the start.
+    Every other goal is drawn with z >= z_floor, and given targets are raised to it.
+
+    backend='kinematic' drives a kinematic_sim.KinematicSimulation instead of PyBullet, which integrates the
+    gantry directly and is much faster, see kinematic_fidelity.py for how closely it follows PyBullet.
+    It has no contact checks, so sensor_hz and physics_preset only apply to the 'pybullet' backend.
     """
     def __init__(self, render=False, max_steps=1000, threshold=0.001, 
                  # **MODIFIED**: Default values are now tuned for high accuracy.
                  bonus_reward=150,
                  reward_distance_scale=200, 
-                 step_penalty=-1):
+                 step_penalty=-1,
+                 action_repeat=1, physics_hz=240, control_hz=None, sensor_hz=None,
+                 physics_preset='balanced', reuse_observation=False, reset_mode='full', num_targets=1, backend='pybullet'):
         super(OT2Env, self).__init__()
+        if reset_mode not in ('full', 'goal'):
+            raise ValueError(f"reset_mode must be 'full' or 'goal', got {reset_mode!r}")
+        if num_targets < 1:
+            raise ValueError(f"num_targets must be at least 1, got {num_targets}")
+        if backend not in ('pybullet', 'kinematic'):
+            raise ValueError(f"backend must be 'pybullet' or 'kinematic', got {backend!r}")
         self.render = render
         self.max_steps = max_steps
         self.threshold = threshold
         self.bonus_reward = bonus_reward
         self.reward_distance_scale = reward_distance_scale
         self.step_penalty = step_penalty
-        self.pipette_position = None
+        # number of physics steps the simulation advances per env step with the same action
+        self.action_repeat = action_repeat
+        self.reuse_observation = reuse_observation
+        self.reset_mode = reset_mode
+        self.num_targets = num_targets
 
         # Create the simulation environment
         # **FIX**: Pass the 'render' flag to the Simulation class to control visualization.
-        self.sim = Simulation(num_agents=1, render=self.render)
+        if backend == 'kinematic':
+            from kinematic_sim import KinematicSimulation
+            self.sim = KinematicSimulation(num_agents=1, render=self.render, physics_hz=physics_hz, control_hz=control_hz)
+        else:
+            self.sim = Simulation(num_agents=1, render=self.render, physics_hz=physics_hz, control_hz=control_hz, sensor_hz=sensor_hz,
+                                  physics_preset=physics_preset)
 
         # Define action and observation space
         self.action_space = spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32)
@@ -36,64 +75,112 @@ class OT2Env(gym.Env):
         )
         self.steps = 0
         self.goal_position = None
+        # the (K,3) goals of the episode in the order they are visited, and the index of the current one
+        self.targets = None
+        self.target_index = 0
+        # lowest pipette height after the first move up, the start height plus the lower limit of the z joint
+        self.z_floor = ENVELOPE_LOW[2] + self.sim.joint_limits()[0][2]
+        # whether the robot is still at the start of a restored world, where the first goal may lie below z_floor
+        self._at_start = True
+
+        # (1,4) action buffer handed to the simulation, the drop column stays 0
+        self._actions = np.zeros((1, 4))
+        # the rounded pipette position as get_states reports it, and the last known position in float32
+        self._rounded_position = np.zeros(3)
+        self.pipette_position = np.zeros(3, dtype=np.float32)
+        self._delta = np.zeros(3)
+        self._observation = np.zeros(6, dtype=np.float32)
+        self._position_low = self.observation_space.low[:3]
+        self._position_high = self.observation_space.high[:3]
+
+    # method to fill the observation buffer from the (N,3) pipette positions of the simulation, returns the distance to the goal
+    def _observe(self, pipette_positions):
+        # Round as get_states does, so the observations match the states dictionary
+        np.round(pipette_positions[0], 4, out=self._rounded_position)
+        self.pipette_position[:] = self._rounded_position
+
+        # Ensure pipette stays within the working envelope
+        observation = self._observation
+        np.clip(self.pipette_position, self._position_low, self._position_high, out=observation[:3])
+        observation[3:] = self.goal_position
+        np.subtract(observation[:3], self.goal_position, out=self._delta)
+        return np.sqrt(self._delta @ self._delta)
+
+    # method to hand out the observation, a copy unless the buffer is reused
+    def _observation_out(self):
+        return self._observation if self.reuse_observation else self._observation.copy()
     
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
 
-        # Set a random goal position for the agent
-        self.goal_position = self.np_random.uniform(
-            low=[-0.1874, -0.1711, 0.1195], high=[0.253, 0.2202, 0.2902]
-        )
-
-        # Call the environment reset function
-        observation = self.sim.reset(num_agents=1)
-
-        # Get the correct robot ID dynamically
-        robot_key = list(observation.keys())[0]
-        pipette_position = np.array(observation[robot_key]['pipette_position'], dtype=np.float32)
-        self.pipette_position = pipette_position
-
-        observation = np.concatenate((pipette_position, self.goal_position)).astype(np.float32)
+        options = options or {}
+
+        # Call the environment reset function, in goal mode the robot stays where it is
+        if self.reset_mode == 'full' or options.get('full_reset', False):
+            self.sim.reset(num_agents=1)
+            self._at_start = True
+        # the first goal may only lie below z_floor while the pipette has not moved up yet
+        first_z_low = ENVELOPE_LOW[2] if self._at_start else self.z_floor
+
+        # Set random goal positions for the agent, visited in order of x as the root tips in pipeline.py
+        if options.get('targets') is not None:
+            self.targets = np.array(options['targets'], dtype=np.float64).reshape(-1, 3)
+            if len(self.targets) == 0:
+                raise ValueError("options['targets'] must hold at least one target")
+            self.targets[0, 2] = max(self.targets[0, 2], first_z_low)
+            self.targets[1:, 2] = np.maximum(self.targets[1:, 2], self.z_floor)
+        else:
+            low = np.tile(ENVELOPE_LOW, (self.num_targets, 1))
+            low[0, 2] = first_z_low
+            low[1:, 2] = self.z_floor
+            self.targets = self.np_random.uniform(low=low, high=ENVELOPE_HIGH, size=(self.num_targets, 3))
+            # only x and y are sorted, the heights are independent of them and the first, possibly lower one stays first
+            order = np.argsort(self.targets[:, 0], kind='stable')
+            self.targets[:, :2] = self.targets[order, :2]
+        self.target_index = 0
+        self.goal_position = self.targets[0]
+
+        self._observe(self.sim.get_state_arrays()[2])
         self.steps = 0
 
-        return observation, {}
+        return self._observation_out(), {}
         
     def step(self, action):
         # The original file from your friend had a scaled action and a 4th element.
         # This is the correct implementation based on that file.
-        scaled_action = np.append(action * 0.5, 0)
+        # The velocities are scaled into the action buffer, the drop column stays 0
+        np.multiply(action[:3], 0.5, out=self._actions[0, :3])
 
         # Call the environment step function
-        observation = self.sim.run([scaled_action])
-
-        # Get the correct robot ID dynamically
-        robot_key = list(observation.keys())[0]
-        pipette_position = np.array(observation[robot_key]['pipette_position'], dtype=np.float32)
-        self.pipette_position = pipette_position
-
-        # Ensure pipette stays within the working envelope
-        pipette_position = np.clip(pipette_position, self.observation_space.low[:3], self.observation_space.high[:3])
-        observation = np.concatenate((pipette_position, self.goal_position)).astype(np.float32)
+        _, _, pipette_positions = self.sim.run_array(self._actions, num_steps=self.action_repeat)
+        self._at_start = False
+        distance = self._observe(pipette_positions)
 
         # --- This is the correct, advanced reward calculation ---
-        distance = np.linalg.norm(pipette_position - self.goal_position)
         # The reward uses the parameters from __init__
         reward = -self.reward_distance_scale * distance + self.step_penalty
 
-        # Add bonus reward for success
-        terminated = bool(distance < self.threshold)
-        if terminated:
+        # Add bonus reward for reaching the goal, the episode ends at the last one
+        reached = bool(distance < self.threshold)
+        info = {"target_reached": reached, "target_index": self.target_index}
+        terminated = reached and self.target_index == len(self.targets) - 1
+        if reached:
             reward += self.bonus_reward
+            if not terminated:
+                # move on to the next goal, which the returned observation already shows
+                self.target_index += 1
+                self.goal_position = self.targets[self.target_index]
+                self._observation[3:] = self.goal_position
 
         truncated = bool(self.steps >= self.max_steps)
-        info = {"success": terminated}
+        info["success"] = terminated
         self.steps += 1
 
-        return observation, reward, terminated, truncated, info
+        return self._observation_out(), reward, terminated, truncated, info
         
     def get_current_position(self):
         """Returns the last known pipette position."""
-        return self.pipette_position
+        return self.pipette_position.copy()
 
     def render(self, mode='human'):
         pass
@@ -0,0 +1,113 @@
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+from sim_class import Simulation
+
+# working envelope of the pipette relative to its own robot, the same bounds OT2Env uses
+ENVELOPE_LOW = np.array([-0.1874, -0.1711, 0.1195])
+ENVELOPE_HIGH = np.array([0.253, 0.2202, 0.2902])
+
+
+class OT2VectorEnv(VectorEnv):
+    """
+    Vectorized version of OT2Env that drives N robots in a single PyBullet world.
+    All robots advance with one stepSimulation call per step, each robot has its own goal
+    and is reset on its own (same-step autoreset) when its episode ends.
+    Observations, rewards and goals are expressed relative to each robot's grid cell,
+    so every robot sees exactly what a single OT2Env would.
+    """
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs, render=False, max_steps=1000, threshold=0.001,
+                 bonus_reward=150,
+                 reward_distance_scale=200,
+                 step_penalty=-1,
+                 action_repeat=1, physics_hz=240, control_hz=None, sensor_hz=None,
+                 physics_preset='balanced'):
+        self.num_envs = num_envs
+        self.max_steps = max_steps
+        self.threshold = threshold
+        self.bonus_reward = bonus_reward
+        self.reward_distance_scale = reward_distance_scale
+        self.step_penalty = step_penalty
+        # number of physics steps the simulation advances per env step with the same actions
+        self.action_repeat = action_repeat
+
+        # Create one simulation with a robot per environment
+        self.sim = Simulation(num_agents=num_envs, render=render, physics_hz=physics_hz, control_hz=control_hz, sensor_hz=sensor_hz,
+                              physics_preset=physics_preset)
+
+        # Define action and observation space of a single robot and of the batch
+        self.single_action_space = spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32)
+        self.single_observation_space = spaces.Box(
+            low=np.concatenate((ENVELOPE_LOW, ENVELOPE_LOW)).astype(np.float32),
+            high=np.concatenate((ENVELOPE_HIGH, ENVELOPE_HIGH)).astype(np.float32),
+            shape=(6,),
+            dtype=np.float32
+        )
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+
+        # offset of each robot's grid cell from the first robot, subtracted from the world pipette positions
+        self._cell_offsets = self.sim.base_position_array - self.sim.base_position_array[0]
+        # (N,4) action buffer handed to the simulation, the drop column stays 0
+        self._actions = np.zeros((num_envs, 4))
+        self.goal_positions = np.zeros((num_envs, 3))
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed, options=options)
+
+        # Set a random goal position for every robot and restore the world
+        self.goal_positions = self.np_random.uniform(low=ENVELOPE_LOW, high=ENVELOPE_HIGH, size=(self.num_envs, 3))
+        self.sim.reset(num_agents=self.num_envs)
+        self.steps[:] = 0
+
+        _, _, pipette_positions = self.sim.get_state_arrays()
+        return self._observations(pipette_positions), {}
+
+    def step(self, actions):
+        # same scaling as OT2Env, the simulation expects (N,4) actions with a drop column
+        self._actions[:, :3] = np.asarray(actions) * 0.5
+        _, _, pipette_positions = self.sim.run_array(self._actions, num_steps=self.action_repeat)
+        observations = self._observations(pipette_positions)
+
+        distances = np.linalg.norm(observations[:, :3] - self.goal_positions, axis=1)
+        rewards = -self.reward_distance_scale * distances + self.step_penalty
+
+        # Add bonus reward for success
+        terminations = distances < self.threshold
+        rewards[terminations] += self.bonus_reward
+
+        truncations = self.steps >= self.max_steps
+        self.steps += 1
+        infos = {"success": terminations.copy(), "_success": np.ones(self.num_envs, dtype=bool)}
+
+        # reset the robots whose episode ended, the last observation of the episode goes into the infos
+        done = terminations | truncations
+        if done.any():
+            # filled element by element, np.array would turn the rows into an (N,6) object array when every robot is done
+            infos["final_obs"] = np.empty(self.num_envs, dtype=object)
+            for i in np.flatnonzero(done):
+                infos["final_obs"][i] = observations[i].copy()
+            infos["_final_obs"] = done.copy()
+            for i in np.flatnonzero(done):
+                self.sim.reset_robot(i)
+            self.goal_positions[done] = self.np_random.uniform(low=ENVELOPE_LOW, high=ENVELOPE_HIGH, size=(int(done.sum()), 3))
+            self.steps[done] = 0
+            _, _, pipette_positions = self.sim.get_state_arrays()
+            observations = self._observations(pipette_positions)
+
+        return observations, rewards, terminations, truncations, infos
+
+    # method to build the batch of observations from the world pipette positions
+    def _observations(self, pipette_positions):
+        # Round as OT2Env does, the cell offsets are whole metres so rounding the local positions gives the same values
+        local_positions = np.round(pipette_positions - self._cell_offsets, 4)
+        # Ensure the pipettes stay within the working envelope
+        np.clip(local_positions, ENVELOPE_LOW, ENVELOPE_HIGH, out=local_positions)
+        return np.concatenate((local_positions, self.goal_positions), axis=1).astype(np.float32)
+
+    def close_extras(self, **kwargs):
+        self.sim.close()
@@ -12,6 +12,11 @@ from skimage.morphology import skeletonize
 from ot2_gym_wrapper_2 import OT2Env 
 from pid_controller import PIDController
 from sim_class import Simulation
+from recorder import VideoRecorder
+from reachability import load_reachability
+
+# set to a file name, e.g. "inoculation.mp4", to record the run from the offscreen camera
+VIDEO_PATH = None
 
 # --- Helper Functions ---
 def f1(y_true, y_pred):
@@ -144,6 +149,17 @@ def convert_pixels_to_robot_coords(pixel_coords):
         robot_coords.append(target_pos)
     return robot_coords
 
+def filter_reachable_targets(targets, reachability):
+    """Lifts every root tip target to the lowest height the pipette reaches above it and drops the root tips it cannot get above."""
+    reachable_targets = []
+    for target in targets:
+        hover = np.array([target[0], target[1], reachability.clamp(target)[2]])
+        if not reachability.is_reachable(hover):
+            print(f"Skipping unreachable root tip at {np.round(target, 4)}")
+            continue
+        reachable_targets.append(hover)
+    return reachable_targets
+
 def main():
     """Main function to run the inoculation task with the PID controller."""
     
@@ -159,6 +175,7 @@ def main():
     # --- Initialization ---
     env = OT2Env(render=True)
     pid = PIDController(kp=5.0, ki=0.5, kd=2.0)
+    recorder = VideoRecorder(env.sim, VIDEO_PATH) if VIDEO_PATH else None
     
     image_path = env.sim.get_plate_image()
     pixel_coordinates = run_cv_pipeline(image_path, cv_model, patch_size=256)
@@ -170,6 +187,8 @@ def main():
     inoculation_targets = convert_pixels_to_robot_coords(sorted_pixel_coordinates)
     
     print(f"\nConverted {len(inoculation_targets)} pixel coordinates to robot coordinates.")
+    # reject the root tips outside the working envelope before spending a motion loop on them
+    inoculation_targets = filter_reachable_targets(inoculation_targets, load_reachability())
     
     obs, _ = env.reset()
     
@@ -206,6 +225,9 @@ def main():
 
     print("\n--- All root tips inoculated. Task complete! ---")
     print(f"Log saved to: {os.path.abspath('inoculation_log.csv')}")
+    if recorder is not None:
+        recorder.close()
+        print(f"Video saved to: {os.path.abspath(VIDEO_PATH)}")
     env.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+import argparse
+import numpy as np
+
+from sim_class import Simulation, PHYSICS_PRESETS
+from kinematic_fidelity import random_action_sequence, rollout
+
+
+def preset_report(num_agents=4, num_steps=2000, hold_steps=120, seed=0, reference='accurate', drop_every=0):
+    """Runs the same random velocity commands under every physics preset and compares the pipette trajectories with the reference preset."""
+    actions = random_action_sequence(np.random.default_rng(seed), num_agents, num_steps, hold_steps)
+    # droplets in flight give the solver contacts to work on
+    if drop_every:
+        actions[::drop_every, :, 3] = 1
+    trajectories = {}
+    steps_per_second = {}
+    droplets_landed = {}
+    for preset in PHYSICS_PRESETS:
+        sim = Simulation(num_agents=num_agents, render=False, physics_preset=preset)
+        trajectories[preset], elapsed = rollout(sim, actions)
+        steps_per_second[preset] = num_steps / elapsed
+        droplets_landed[preset] = sum(len(positions) for positions in sim.droplet_positions.values())
+        sim.close()
+
+    report = {}
+    for preset, trajectory in trajectories.items():
+        error = np.abs(trajectory - trajectories[reference])
+        report[preset] = {
+            "steps_per_second": steps_per_second[preset],
+            "droplets_landed": droplets_landed[preset],
+            "rms_error_mm": np.sqrt((error ** 2).mean(axis=(0, 1))) * 1000,
+            "max_error_mm": error.max(axis=(0, 1)) * 1000,
+            "final_error_mm": np.linalg.norm(trajectory[-1] - trajectories[reference][-1], axis=1).mean() * 1000,
+        }
+    return report
+
+
+def main(args):
+    report = preset_report(args.num_agents, args.num_steps, args.hold_steps, args.seed, args.reference, args.drop_every)
+    print(f"--- Physics presets against '{args.reference}' ({args.num_agents} agents, {args.num_steps} steps) ---")
+    for preset, result in report.items():
+        print(f"{preset:>9}: {result['steps_per_second']:7.0f} steps/s, "
+              f"RMS error (mm) {np.round(result['rms_error_mm'], 3)}, "
+              f"max error (mm) {np.round(result['max_error_mm'], 3)}, "
+              f"final error {result['final_error_mm']:.3f} mm, droplets landed {result['droplets_landed']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_agents", type=int, default=4)
+    parser.add_argument("--num_steps", type=int, default=2000)
+    parser.add_argument("--hold_steps", type=int, default=120, help="Steps each random velocity command is held")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drop_every", type=int, default=0, help="Drop a droplet from every pipette every this many steps, 0 for none")
+    parser.add_argument("--reference", type=str, default="accurate", choices=list(PHYSICS_PRESETS))
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,118 @@
+import argparse
+import json
+from time import perf_counter_ns
+
+# the stages of a Simulation step, in the order they run
+STAGES = ('apply_actions', 'step_simulation', 'check_contacts', 'camera', 'step_callbacks', 'render_sleep',
+          'get_states', 'get_state_arrays')
+# histogram bucket b counts the durations of b bits in nanoseconds, i.e. from 2**(b-1) up to 2**b ns
+NUM_BUCKETS = 40
+
+
+class StageProfiler:
+    """
+    Per-stage counters and duration histograms for Simulation, enabled with Simulation(profile=True).
+    The simulation times each stage with perf_counter_ns and calls lap, which only adds to plain
+    integer counters and a log2 histogram, nothing is logged or allocated inside the step loop.
+    """
+    def __init__(self, stages=STAGES):
+        self.stages = stages
+        self.reset()
+
+    def reset(self):
+        self.counts = dict.fromkeys(self.stages, 0)
+        self.total_ns = dict.fromkeys(self.stages, 0)
+        self.max_ns = dict.fromkeys(self.stages, 0)
+        self.histograms = {stage: [0] * NUM_BUCKETS for stage in self.stages}
+        # sum of all recorded durations, lets an outer stage leave out the stages lapped inside it
+        self.profiled_ns = 0
+
+    # method to record the time since start for a stage, returns the current time so the next stage can start from it
+    # nested_ns is the time of other stages lapped in between, which is left out so that the stages stay disjoint
+    def lap(self, stage, start, nested_ns=0):
+        now = perf_counter_ns()
+        elapsed = now - start - nested_ns
+        self.profiled_ns += elapsed
+        self.counts[stage] += 1
+        self.total_ns[stage] += elapsed
+        if elapsed > self.max_ns[stage]:
+            self.max_ns[stage] = elapsed
+        self.histograms[stage][min(elapsed.bit_length(), NUM_BUCKETS - 1)] += 1
+        return now
+
+    # method to estimate a percentile from the histogram, as the upper bound of the bucket it falls in
+    def _percentile_ns(self, stage, fraction):
+        target = fraction * self.counts[stage]
+        seen = 0
+        for bucket, count in enumerate(self.histograms[stage]):
+            seen += count
+            if seen >= target:
+                return min(2 ** bucket, self.max_ns[stage])
+        return self.max_ns[stage]
+
+    # method to summarise every stage that ran, times in microseconds and share of the total profiled time
+    def stats(self):
+        profiled_ns = self.profiled_ns
+        stats = {}
+        for stage in self.stages:
+            count = self.counts[stage]
+            if not count:
+                continue
+            stats[stage] = {
+                "count": count,
+                "total_ms": self.total_ns[stage] / 1e6,
+                "mean_us": self.total_ns[stage] / count / 1e3,
+                "p50_us": self._percentile_ns(stage, 0.5) / 1e3,
+                "p99_us": self._percentile_ns(stage, 0.99) / 1e3,
+                "max_us": self.max_ns[stage] / 1e3,
+                "share": self.total_ns[stage] / profiled_ns if profiled_ns else 0.0,
+                # upper bound of each non-empty bucket in ns -> count
+                "histogram_ns": {str(2 ** bucket): n for bucket, n in enumerate(self.histograms[stage]) if n},
+            }
+        return stats
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.stats(), file, indent=2)
+
+
+def main(args):
+    import numpy as np
+    from sim_class import Simulation
+
+    sim = Simulation(num_agents=args.num_agents, render=False, rgb_array=args.rgb_array, droplet_pool_size=args.num_agents,
+                     physics_preset=args.physics_preset, profile=True)
+    rng = np.random.default_rng(args.seed)
+    actions = np.zeros((args.num_agents, 4))
+    for step in range(args.num_steps):
+        if step % 60 == 0:
+            actions[:, :3] = rng.uniform(-1, 1, size=(args.num_agents, 3))
+        # a droplet from every pipette now and then keeps the contact checks busy
+        actions[:, 3] = 1 if args.drop_every and step % args.drop_every == 0 else 0
+        if args.dict_states:
+            sim.run(actions.tolist())
+        else:
+            sim.run_array(actions)
+
+    print(f"--- Simulation stages ({args.num_agents} agents, {args.num_steps} steps, {len(sim.sphereIds)} droplets in the world) ---")
+    print(f"{'stage':>17} {'count':>8} {'total (ms)':>11} {'mean (us)':>10} {'p99 (us)':>9} {'share':>7}")
+    for stage, result in sim.stats().items():
+        print(f"{stage:>17} {result['count']:>8} {result['total_ms']:>11.1f} {result['mean_us']:>10.1f} "
+              f"{result['p99_us']:>9.1f} {result['share']:>7.1%}")
+    if args.output:
+        sim.dump_stats(args.output)
+        print(f"Saved to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_agents", type=int, default=16)
+    parser.add_argument("--num_steps", type=int, default=2000)
+    parser.add_argument("--drop_every", type=int, default=30, help="Drop a droplet from every pipette every this many steps, 0 for none")
+    parser.add_argument("--rgb_array", action="store_true", help="Render the offscreen camera on every sensor tick")
+    parser.add_argument("--dict_states", action="store_true", help="Step with run and the states dictionary instead of run_array")
+    parser.add_argument("--physics_preset", type=str, default="balanced")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="JSON file for the stats")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+
+from sim_class import Simulation, ROBOT_URDF_PATH
+from kinematic_sim import load_envelope
+
+# probed grids are stored next to this file, one per robot urdf and voxel size
+REACHABILITY_DIR = os.path.dirname(os.path.abspath(__file__))
+# the robot at the origin, the grid holds pipette positions in its frame as working_envelope.csv does
+REFERENCE_BASE = np.array([0, 0, 0.03])
+
+
+def urdf_hash(path=ROBOT_URDF_PATH):
+    """Returns a short hash of the robot urdf, a probed grid is only valid for the urdf it was probed with."""
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()[:16]
+
+
+def reachability_path(voxel_size, urdf_path=ROBOT_URDF_PATH):
+    return os.path.join(REACHABILITY_DIR, f'reachability_{urdf_hash(urdf_path)}_{voxel_size * 1000:g}mm.npz')
+
+
+def _serpentine(shape):
+    """Returns the indices of a 3d grid in an order where consecutive voxels are neighbours."""
+    order = []
+    for i in range(shape[0]):
+        for jj in range(shape[1]):
+            j = jj if i % 2 == 0 else shape[1] - 1 - jj
+            ks = range(shape[2]) if (i * shape[1] + jj) % 2 == 0 else range(shape[2] - 1, -1, -1)
+            order.extend((i, j, k) for k in ks)
+    return np.array(order)
+
+
+def _nearest_reachable(reachable):
+    """Returns the flat index of the nearest reachable voxel for every voxel, -1 everywhere if none is reachable."""
+    flat = reachable.ravel()
+    nearest = np.where(flat, np.arange(flat.size), -1)
+    if not flat.any():
+        return nearest.reshape(reachable.shape)
+    # the nearest reachable voxel of an unreachable one is always on the surface of the reachable set
+    padded = np.pad(reachable, 1)
+    interior = reachable.copy()
+    for axis in range(3):
+        for shift in (-1, 1):
+            interior &= np.roll(padded, shift, axis=axis)[1:-1, 1:-1, 1:-1]
+    surface = np.flatnonzero((reachable & ~interior).ravel())
+    surface_cells = np.stack(np.unravel_index(surface, reachable.shape), axis=1)
+    unreachable = np.flatnonzero(~flat)
+    cells = np.stack(np.unravel_index(unreachable, reachable.shape), axis=1)
+    block = max(1, 2 ** 22 // len(surface_cells))
+    for start in range(0, len(cells), block):
+        squared = ((cells[start:start + block, None, :] - surface_cells[None, :, :]) ** 2).sum(axis=2)
+        nearest[unreachable[start:start + block]] = surface[squared.argmin(axis=1)]
+    return nearest.reshape(reachable.shape)
+
+
+class ReachabilityGrid:
+    """
+    Voxel grid of the pipette positions the OT-2 can reach, in the frame of a robot placed at the origin.
+    A voxel is reachable when the pipette was driven to its centre during probing, so the answer is exact
+    up to the voxel size. Lookups are a single array index: is_reachable checks the voxel of a position and
+    clamp moves an unreachable position to the centre of the nearest reachable voxel, which is precomputed.
+    """
+    def __init__(self, origin, voxel_size, reachable, nearest=None, urdf_hash=None):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel_size = float(voxel_size)
+        self.reachable = np.asarray(reachable, dtype=bool)
+        self.nearest = _nearest_reachable(self.reachable) if nearest is None else np.asarray(nearest)
+        self.urdf_hash = urdf_hash
+        self.shape = np.array(self.reachable.shape)
+
+    # method to get the voxel indices of (n,3) positions and whether they lie inside the grid
+    def _voxels(self, positions):
+        voxels = np.floor((positions - self.origin) / self.voxel_size).astype(np.int64)
+        inside = ((voxels >= 0) & (voxels < self.shape)).all(axis=-1)
+        return voxels, inside
+
+    def centre(self, voxel):
+        return self.origin + (np.asarray(voxel) + 0.5) * self.voxel_size
+
+    # the low and high corner of the reachable voxel centres
+    @property
+    def bounds(self):
+        voxels = np.argwhere(self.reachable)
+        return self.centre(voxels.min(axis=0)), self.centre(voxels.max(axis=0))
+
+    def is_reachable(self, position):
+        voxel, inside = self._voxels(np.asarray(position, dtype=np.float64))
+        return bool(inside) and bool(self.reachable[tuple(voxel)])
+
+    # method to check an (n,3) array of positions at once
+    def reachable_mask(self, positions):
+        voxels, inside = self._voxels(np.asarray(positions, dtype=np.float64).reshape(-1, 3))
+        mask = np.zeros(len(voxels), dtype=bool)
+        mask[inside] = self.reachable[tuple(voxels[inside].T)]
+        return mask
+
+    # method to get a reachable position close to position, a reachable position is returned as it is
+    def clamp(self, position):
+        position = np.asarray(position, dtype=np.float64)
+        voxel, inside = self._voxels(position)
+        if inside and self.reachable[tuple(voxel)]:
+            return position.copy()
+        # outside the grid the nearest reachable voxel of the closest voxel on the border stands in
+        voxel = np.clip(voxel, 0, self.shape - 1)
+        nearest = self.nearest[tuple(voxel)]
+        if nearest < 0:
+            raise ValueError("the reachability grid has no reachable voxels")
+        return self.centre(np.unravel_index(nearest, self.reachable.shape))
+
+    def save(self, path):
+        np.savez_compressed(path, origin=self.origin, voxel_size=self.voxel_size, reachable=self.reachable,
+                            nearest=self.nearest, urdf_hash=self.urdf_hash or '')
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['origin'], float(data['voxel_size']), data['reachable'], data['nearest'], str(data['urdf_hash']) or None)
+
+
+def probe_reachability(voxel_size=0.01, num_agents=64, margin=2, low=None, high=None, tolerance=0.001,
+                       gain=20.0, max_steps_per_voxel=120, physics_preset='balanced'):
+    """
+    Drives num_agents robots in parallel to every voxel centre of the box low..high (the working envelope csv by default)
+    grown by margin voxels, and returns the ReachabilityGrid of the centres the pipettes got within tolerance of.
+    Each robot takes a neighbouring run of voxels, a voxel is given up when the robot stops short of it or after max_steps_per_voxel.
+    Positions below the urdf limit of the z joint, only reachable before the pipette first moves up, count as unreachable.
+    """
+    if low is None or high is None:
+        envelope_low, envelope_high = load_envelope()
+        low = envelope_low if low is None else low
+        high = envelope_high if high is None else high
+    origin = np.asarray(low, dtype=np.float64) - margin * voxel_size
+    shape = np.ceil((np.asarray(high, dtype=np.float64) + margin * voxel_size - origin) / voxel_size).astype(int)
+    order = _serpentine(shape)
+    centres = origin + (order + 0.5) * voxel_size
+
+    sim = Simulation(num_agents=num_agents, render=False, physics_preset=physics_preset)
+    # the z joint starts below its urdf limit and can not get back there once it has moved up,
+    # lift every pipette first so the grid holds what a robot can reach after its first move
+    lift = np.zeros((num_agents, 4))
+    lift[:, 2] = 1
+    sim.run_until(lift, velocity_epsilon=1e-3, max_steps=2000)
+    # the robots stand in a grid, every robot probes in its own frame
+    offsets = sim.base_position_array - REFERENCE_BASE
+    chunks = np.array_split(np.arange(len(order)), num_agents)
+    cursor = np.array([chunk[0] if len(chunk) else -1 for chunk in chunks])
+    chunk_end = np.array([chunk[-1] + 1 if len(chunk) else -1 for chunk in chunks])
+    steps_on_voxel = np.zeros(num_agents, dtype=int)
+    reached = np.zeros(len(order), dtype=bool)
+    actions = np.zeros((num_agents, 4))
+
+    active = cursor >= 0
+    while active.any():
+        targets = centres[np.maximum(cursor, 0)] + offsets
+        _, joint_velocities, pipette_positions = sim.get_state_arrays()
+        errors = targets - pipette_positions
+        hit = active & (np.linalg.norm(errors, axis=1) <= tolerance)
+        # a robot pressing against a limit has stopped without getting there
+        stopped = active & (steps_on_voxel > 3) & (np.abs(joint_velocities) < 1e-3).all(axis=1)
+        done = hit | stopped | (active & (steps_on_voxel >= max_steps_per_voxel))
+        reached[cursor[hit]] = True
+        cursor[done] += 1
+        steps_on_voxel[done] = 0
+        active &= cursor < chunk_end
+        cursor[~active] = -1
+
+        actions[:, :3] = np.clip(gain * (centres[np.maximum(cursor, 0)] + offsets - pipette_positions), -1, 1)
+        actions[~active, :3] = 0
+        sim.run_array(actions)
+        steps_on_voxel[active] += 1
+    sim.close()
+
+    reachable = np.zeros(shape, dtype=bool)
+    reachable[tuple(order[reached].T)] = True
+    return ReachabilityGrid(origin, voxel_size, reachable, urdf_hash=urdf_hash())
+
+
+def load_reachability(voxel_size=0.01, path=None, **probe_kwargs):
+    """Returns the stored grid of the current robot urdf, probing and storing it first if there is none yet."""
+    path = path or reachability_path(voxel_size)
+    if os.path.exists(path):
+        grid = ReachabilityGrid.load(path)
+        if grid.urdf_hash == urdf_hash():
+            return grid
+    grid = probe_reachability(voxel_size, **probe_kwargs)
+    grid.save(path)
+    return grid
+
+
+def main(args):
+    start = time.perf_counter()
+    grid = probe_reachability(args.voxel_size, args.num_agents, args.margin, physics_preset=args.physics_preset)
+    path = args.output or reachability_path(args.voxel_size)
+    grid.save(path)
+    low, high = grid.bounds
+    print(f"Probed {grid.reachable.size} voxels of {args.voxel_size * 1000:g} mm with {args.num_agents} robots in {time.perf_counter() - start:.1f} s")
+    print(f"{grid.reachable.sum()} reachable, voxel centres from {np.round(low, 4)} to {np.round(high, 4)}")
+    print(f"Saved to {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--voxel_size", type=float, default=0.01, help="Edge of a voxel in metres")
+    parser.add_argument("--num_agents", type=int, default=64, help="Robots probing in parallel")
+    parser.add_argument("--margin", type=int, default=2, help="Voxels probed outside the measured working envelope")
+    parser.add_argument("--physics_preset", type=str, default="balanced")
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,76 @@
+import queue
+import threading
+
+import cv2
+
+
+class VideoRecorder:
+    """
+    Records a Simulation to a video file without blocking the physics loop.
+    Every 1/fps seconds of simulated time a frame is taken from the simulation's offscreen camera
+    and queued, a background thread converts the frames to BGR and encodes them with cv2.VideoWriter.
+    When the encoder falls behind and the queue is full the frame is dropped instead of waiting.
+    """
+    def __init__(self, sim, path, fps=30, fourcc='mp4v', queue_size=64):
+        if fps <= 0:
+            raise ValueError(f"fps must be positive, got {fps}")
+        self.sim = sim
+        self.path = path
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        # physics steps between two frames, kept as a float so that fps does not need to divide physics_hz
+        self.frame_interval = sim.physics_hz / fps
+        self._next_frame_step = sim.physics_step
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.closed = False
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._encode, name='VideoRecorder', daemon=True)
+        self._thread.start()
+        sim.step_callbacks.append(self.on_step)
+
+    # method called by the simulation after every physics step
+    def on_step(self, sim):
+        if sim.physics_step < self._next_frame_step:
+            return
+        self._next_frame_step += self.frame_interval
+        # with rgb_array the camera has often rendered this very step already, only render when it has not
+        frame = sim.current_frame if sim.frame_step == sim.physics_step else sim.capture_frame()
+        # the camera ring buffer is reused, so the queued frame must be a copy
+        frame = frame.copy()
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.frames_dropped += 1
+
+    # method run by the background thread, the writer is opened with the size of the first frame
+    def _encode(self):
+        writer = None
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, (width, height))
+            writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            self.frames_written += 1
+        if writer is not None:
+            writer.release()
+
+    # method to stop recording, waits for the queued frames to be encoded
+    def close(self):
+        if self.closed:
+            return
+        if self.on_step in self.sim.step_callbacks:
+            self.sim.step_callbacks.remove(self.on_step)
+        self._queue.put(None)
+        self._thread.join()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,132 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pybullet as p
+
+
+def _floats(text, default):
+    return [float(value) for value in text.split()] if text else list(default)
+
+
+def _origin(element):
+    """Returns the (position, quaternion) of the origin tag of a urdf element."""
+    origin = element.find('origin') if element is not None else None
+    if origin is None:
+        return [0, 0, 0], [0, 0, 0, 1]
+    return _floats(origin.get('xyz'), [0, 0, 0]), p.getQuaternionFromEuler(_floats(origin.get('rpy'), [0, 0, 0]))
+
+
+class RobotTemplate:
+    """
+    Spawns copies of a fixed-base urdf robot with createMultiBody.
+    loadURDF parses the meshes and computes the convex hulls again for every robot and saveState
+    serializes every copy of a concave mesh, the copies made here share one collision and visual
+    shape per link. The shapes and joints are read from the urdf, the link inertia, joint limits,
+    damping and maximum velocity are copied from a reference robot loaded with loadURDF so that
+    the copies step exactly like it.
+    """
+    def __init__(self, client, urdf_path, reference_body):
+        self._p = client
+        root = ET.parse(urdf_path).getroot()
+        mesh_dir = os.path.dirname(urdf_path)
+        colors = {material.get('name'): _floats(material.find('color').get('rgba'), [1, 1, 1, 1])
+                  for material in root.findall('material') if material.find('color') is not None}
+        # only the top level tags, transmissions have joint tags of their own
+        links = {link.get('name'): link for link in root.findall('link')}
+        joints = {joint.get('name'): joint for joint in root.findall('joint')}
+
+        base_name = self._p.getBodyInfo(reference_body)[0].decode()
+        self.base_collision_shape, self.base_visual_shape = self._link_shapes(links[base_name], mesh_dir, colors)
+        base_dynamics = self._p.getDynamicsInfo(reference_body, -1)
+        self.base_inertial_position, self.base_inertial_orientation = base_dynamics[3], base_dynamics[4]
+
+        self.link_masses = []
+        self.link_collision_shapes = []
+        self.link_visual_shapes = []
+        self.link_positions = []
+        self.link_orientations = []
+        self.link_inertial_positions = []
+        self.link_inertial_orientations = []
+        self.link_parents = []
+        self.joint_types = []
+        self.joint_axes = []
+        # changeDynamics calls per link, applied after every spawn
+        self.link_dynamics = []
+        for linkIndex in range(self._p.getNumJoints(reference_body)):
+            joint_info = self._p.getJointInfo(reference_body, linkIndex)
+            joint = joints[joint_info[1].decode()]
+            collision_shape, visual_shape = self._link_shapes(links[joint_info[12].decode()], mesh_dir, colors)
+            dynamics = self._p.getDynamicsInfo(reference_body, linkIndex)
+            position, orientation = _origin(joint)
+            axis = joint.find('axis')
+
+            self.link_masses.append(dynamics[0])
+            self.link_collision_shapes.append(collision_shape)
+            self.link_visual_shapes.append(visual_shape)
+            self.link_positions.append(position)
+            self.link_orientations.append(orientation)
+            self.link_inertial_positions.append(dynamics[3])
+            self.link_inertial_orientations.append(dynamics[4])
+            # createMultiBody counts the base as 0
+            self.link_parents.append(joint_info[16] + 1)
+            self.joint_types.append(joint_info[2])
+            self.joint_axes.append(_floats(axis.get('xyz') if axis is not None else None, [1, 0, 0]))
+
+            link_dynamics = [{'localInertiaDiagonal': dynamics[2], 'jointDamping': joint_info[6], 'maxJointVelocity': joint_info[11]}]
+            # pybullet reports a joint without limits as lower > upper, and ignores the limits when changeDynamics gets other arguments too
+            if joint_info[8] <= joint_info[9]:
+                link_dynamics.append({'jointLowerLimit': joint_info[8], 'jointUpperLimit': joint_info[9]})
+            self.link_dynamics.append(link_dynamics)
+
+    # method to create the collision and visual shape of a link from its first collision and visual tag
+    def _link_shapes(self, link, mesh_dir, colors):
+        collision, visual = link.find('collision'), link.find('visual')
+        collision_shape = visual_shape = -1
+        if collision is not None:
+            flags = p.GEOM_FORCE_CONCAVE_TRIMESH if collision.get('concave') == 'true' else 0
+            position, orientation = _origin(collision)
+            collision_shape = self._p.createCollisionShape(collisionFramePosition=position, collisionFrameOrientation=orientation,
+                                                           flags=flags, **self._geometry(collision, mesh_dir))
+        if visual is not None:
+            position, orientation = _origin(visual)
+            material = visual.find('material')
+            rgba = colors.get(material.get('name'), [1, 1, 1, 1]) if material is not None else [1, 1, 1, 1]
+            visual_shape = self._p.createVisualShape(visualFramePosition=position, visualFrameOrientation=orientation,
+                                                     rgbaColor=rgba, **self._geometry(visual, mesh_dir))
+        return collision_shape, visual_shape
+
+    # method to convert the geometry tag of a collision or visual tag into createCollisionShape/createVisualShape arguments
+    @staticmethod
+    def _geometry(element, mesh_dir):
+        geometry = element.find('geometry')
+        mesh, box = geometry.find('mesh'), geometry.find('box')
+        if mesh is not None:
+            return {'shapeType': p.GEOM_MESH, 'fileName': os.path.join(mesh_dir, mesh.get('filename')),
+                    'meshScale': _floats(mesh.get('scale'), [1, 1, 1])}
+        if box is not None:
+            return {'shapeType': p.GEOM_BOX, 'halfExtents': [size / 2 for size in _floats(box.get('size'), [1, 1, 1])]}
+        raise ValueError(f"RobotTemplate only supports mesh and box geometry, got {[child.tag for child in geometry]}")
+
+    # method to create a copy of the robot with its base fixed at position
+    def spawn(self, position, orientation=(0, 0, 0, 1)):
+        robotId = self._p.createMultiBody(baseMass=0,
+                                          baseCollisionShapeIndex=self.base_collision_shape,
+                                          baseVisualShapeIndex=self.base_visual_shape,
+                                          basePosition=position,
+                                          baseOrientation=orientation,
+                                          baseInertialFramePosition=self.base_inertial_position,
+                                          baseInertialFrameOrientation=self.base_inertial_orientation,
+                                          linkMasses=self.link_masses,
+                                          linkCollisionShapeIndices=self.link_collision_shapes,
+                                          linkVisualShapeIndices=self.link_visual_shapes,
+                                          linkPositions=self.link_positions,
+                                          linkOrientations=self.link_orientations,
+                                          linkInertialFramePositions=self.link_inertial_positions,
+                                          linkInertialFrameOrientations=self.link_inertial_orientations,
+                                          linkParentIndices=self.link_parents,
+                                          linkJointTypes=self.joint_types,
+                                          linkJointAxis=self.joint_axes)
+        for linkIndex, link_dynamics in enumerate(self.link_dynamics):
+            for arguments in link_dynamics:
+                self._p.changeDynamics(robotId, linkIndex, **arguments)
+        return robotId
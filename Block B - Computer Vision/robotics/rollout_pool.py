@@ -0,0 +1,65 @@
+import multiprocessing as mp
+import numpy as np
+
+from sim_class import Simulation
+
+# the simulation of a worker process, built once by _init_worker
+_worker_sim = None
+
+
+def rollout_from(sim, state, actions):
+    """Restores state and applies the (steps, num_agents, 4) actions one control step each, returns the (steps, num_agents, 3) pipette positions."""
+    sim.restore_state(state)
+    trajectory = np.empty((len(actions), state.num_agents, 3))
+    for t, action in enumerate(actions):
+        trajectory[t] = sim.run_array(action)[2]
+    return trajectory
+
+
+def _init_worker(sim_kwargs):
+    global _worker_sim
+    _worker_sim = Simulation(render=False, **sim_kwargs)
+
+
+def _worker_rollout(arguments):
+    state, actions = arguments
+    return rollout_from(_worker_sim, state, actions)
+
+
+class RolloutPool:
+    """
+    Worker processes that each own a Simulation, for rolling out K candidate action sequences from the
+    same captured WorldState in parallel, e.g. the samples of a sampling-based MPC step.
+    The workers build their world from the same arguments as the caller so that a pickled state fits it,
+    sim_kwargs are the Simulation arguments of the caller and must include num_agents.
+    """
+    def __init__(self, num_workers, sim_kwargs, start_method='forkserver'):
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be at least 1, got {num_workers}")
+        sim_kwargs = dict(sim_kwargs)
+        if 'num_agents' not in sim_kwargs:
+            raise ValueError("sim_kwargs must include num_agents, the workers need the same world as the caller")
+        sim_kwargs.pop('render', None)
+        # a worker whose Simulation fails to build is respawned by the pool forever, so the arguments are tried here first
+        try:
+            Simulation(render=False, **sim_kwargs).close()
+        except TypeError as error:
+            raise ValueError(f"invalid sim_kwargs: {error}")
+        context = mp.get_context(start_method)
+        self.num_workers = num_workers
+        self._pool = context.Pool(num_workers, initializer=_init_worker, initargs=(sim_kwargs,))
+
+    # method to roll out every action sequence from state, the trajectories come back in the same order
+    def rollout(self, state, action_sequences):
+        tasks = [(state, np.asarray(actions, dtype=np.float64)) for actions in action_sequences]
+        return self._pool.map(_worker_rollout, tasks)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
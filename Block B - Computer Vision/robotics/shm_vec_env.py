@@ -0,0 +1,228 @@
+import os
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+# fields exchanged through shared memory, (name, dtype, per-env shape), None is replaced by the observation or action shape
+_FIELDS = [
+    ("obs", np.float32, None),
+    ("final_obs", np.float32, None),
+    ("actions", np.float32, None),
+    ("rewards", np.float32, ()),
+    ("dones", np.bool_, ()),
+    ("truncated", np.bool_, ()),
+    ("success", np.bool_, ()),
+    ("step_count", np.int64, ()),
+    ("step_ns", np.int64, ()),
+]
+
+# one byte commands sent to the workers, everything else travels through shared memory
+_STEP = b"s"
+_RESET = b"r"
+_CLOSE = b"c"
+
+
+def _layout(num_envs, obs_shape, action_shape):
+    """Returns the (name, dtype, shape, offset) of every shared array and the total size in bytes."""
+    layout = []
+    offset = 0
+    for name, dtype, shape in _FIELDS:
+        if shape is None:
+            shape = action_shape if name == "actions" else obs_shape
+        shape = (num_envs,) + tuple(shape)
+        # keep every array 8-byte aligned
+        offset = (offset + 7) // 8 * 8
+        layout.append((name, dtype, shape, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return layout, max(offset, 1)
+
+
+def _views(buffer, layout):
+    return {name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            for name, dtype, shape, offset in layout}
+
+
+def _worker(rank, remote, parent_remote, env_kwargs, cpu):
+    parent_remote.close()
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+    # Import here so that the parent does not need a simulation of its own
+    from ot2_gym_wrapper_2 import OT2Env
+    env = OT2Env(**env_kwargs)
+    remote.send((env.observation_space, env.action_space))
+
+    # the parent allocates the shared memory once it knows the spaces
+    shm_name, layout = remote.recv()
+    # the workers share the parent's resource tracker, the parent unlinks the block on close
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = _views(shm.buf, layout)
+    # rows of this worker, the per-env scalars are written through arrays[name][rank]
+    obs, final_obs, actions = arrays["obs"][rank], arrays["final_obs"][rank], arrays["actions"][rank]
+
+    try:
+        while True:
+            cmd = remote.recv_bytes()
+            if cmd == _STEP:
+                start = time.perf_counter_ns()
+                observation, reward, terminated, truncated, info = env.step(actions.copy())
+                done = terminated or truncated
+                if done:
+                    # save the final observation where the parent can get it, then reset
+                    final_obs[...] = observation
+                    observation, _ = env.reset()
+                obs[...] = observation
+                arrays["rewards"][rank] = reward
+                arrays["dones"][rank] = done
+                arrays["truncated"][rank] = truncated and not terminated
+                arrays["success"][rank] = info.get("success", False)
+                arrays["step_count"][rank] += 1
+                arrays["step_ns"][rank] += time.perf_counter_ns() - start
+                remote.send_bytes(_STEP)
+            elif cmd == _RESET:
+                seed, options = remote.recv()
+                maybe_options = {"options": options} if options else {}
+                observation, _ = env.reset(seed=seed, **maybe_options)
+                obs[...] = observation
+                remote.send_bytes(_RESET)
+            elif cmd == _CLOSE:
+                break
+            else:
+                # rarely used calls (get_attr, set_attr, env_method) are pickled
+                method, args = remote.recv()
+                if method == "get_attr":
+                    remote.send(getattr(env, args))
+                elif method == "set_attr":
+                    remote.send(setattr(env, *args))
+                elif method == "env_method":
+                    name, method_args, method_kwargs = args
+                    remote.send(getattr(env, name)(*method_args, **method_kwargs))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        # drop the views before closing the block
+        del obs, final_obs, actions, arrays
+        env.close()
+        shm.close()
+        remote.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Stable-baselines3 VecEnv that runs one OT2Env per worker process.
+    Observations, actions, rewards and done flags are exchanged through shared-memory
+    ndarrays, the pipes only carry one byte commands. Workers can be pinned to a core each
+    and keep count of their steps so that per-worker step rates can be reported.
+    """
+    def __init__(self, num_envs, env_kwargs=None, pin_workers=True, start_method=None):
+        env_kwargs = env_kwargs or {}
+        if start_method is None:
+            # forkserver and spawn are safer than fork with a physics engine loaded
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(num_envs)])
+        self.processes = []
+        for rank, (work_remote, remote) in enumerate(zip(work_remotes, self.remotes)):
+            cpu = cpus[rank % len(cpus)] if pin_workers and cpus else None
+            process = ctx.Process(target=_worker, args=(rank, work_remote, remote, env_kwargs, cpu), daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        observation_space, action_space = self.remotes[0].recv()
+        for remote in self.remotes[1:]:
+            remote.recv()
+
+        layout, size = _layout(num_envs, observation_space.shape, action_space.shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._arrays = _views(self._shm.buf, layout)
+        for array in self._arrays.values():
+            array[...] = 0
+        for remote in self.remotes:
+            remote.send((self._shm.name, layout))
+
+        self.closed = False
+        self.waiting = False
+        self._start_time = time.perf_counter()
+        super().__init__(num_envs, observation_space, action_space)
+
+    def step_async(self, actions):
+        self._arrays["actions"][...] = np.asarray(actions).reshape(self._arrays["actions"].shape)
+        for remote in self.remotes:
+            remote.send_bytes(_STEP)
+        self.waiting = True
+
+    def step_wait(self):
+        for remote in self.remotes:
+            remote.recv_bytes()
+        self.waiting = False
+
+        dones = self._arrays["dones"].copy()
+        infos = []
+        for i in range(self.num_envs):
+            info = {"success": bool(self._arrays["success"][i]),
+                    "TimeLimit.truncated": bool(self._arrays["truncated"][i])}
+            if dones[i]:
+                info["terminal_observation"] = self._arrays["final_obs"][i].copy()
+            infos.append(info)
+        return self._arrays["obs"].copy(), self._arrays["rewards"].copy(), dones, infos
+
+    def reset(self):
+        for env_idx, remote in enumerate(self.remotes):
+            remote.send_bytes(_RESET)
+            remote.send((self._seeds[env_idx], self._options[env_idx]))
+        for remote in self.remotes:
+            remote.recv_bytes()
+        # Seeds and options are only used once
+        self._reset_seeds()
+        self._reset_options()
+        self.reset_infos = [{} for _ in range(self.num_envs)]
+        return self._arrays["obs"].copy()
+
+    def worker_step_rates(self):
+        """Returns per worker steps, steps per second of env.step time and steps per second of wall time since start."""
+        elapsed = time.perf_counter() - self._start_time
+        steps = self._arrays["step_count"].copy()
+        busy_seconds = self._arrays["step_ns"] / 1e9
+        busy_rates = np.divide(steps, busy_seconds, out=np.zeros(self.num_envs), where=busy_seconds > 0)
+        return {"steps": steps, "steps_per_second": busy_rates, "wall_steps_per_second": steps / elapsed}
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv_bytes()
+        for remote in self.remotes:
+            remote.send_bytes(_CLOSE)
+        for process in self.processes:
+            process.join()
+        self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+        self.closed = True
+
+    def _call(self, method, args, indices):
+        remotes = [self.remotes[i] for i in self._get_indices(indices)]
+        for remote in remotes:
+            remote.send_bytes(b"m")
+            remote.send((method, args))
+        return [remote.recv() for remote in remotes]
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call("get_attr", attr_name, indices)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call("set_attr", (attr_name, value), indices)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call("env_method", (method_name, method_args, method_kwargs), indices)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        # the workers run a bare OT2Env
+        return [False for _ in self._get_indices(indices)]
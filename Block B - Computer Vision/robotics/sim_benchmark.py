@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import pybullet as p
+
+from sim_class import Simulation
+
+# stored results the suite compares against, rewritten with --save
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim_benchmark_baseline.json')
+# bump when the scenarios or what they measure change, a baseline of another version is not compared against
+BASELINE_VERSION = 2
+DEFAULT_REPEATS = 5
+# run-to-run spread of the medians reached about 30% on a shared development machine, a regression has to stand out from that
+DEFAULT_TOLERANCE = 0.4
+# resets take a fraction of a millisecond, a slowdown this small is timer noise rather than a regression
+RESET_SLACK_MS = 0.5
+
+# name -> what is stepped, with how many robots, how often every pipette drops a droplet (0 for never), whether the
+# offscreen camera renders on every step, the physics preset and how many steps are timed
+SCENARIOS = {
+    'sim_1': dict(kind='simulation', num_agents=1, drop_every=0, rgb_array=False, physics_preset='balanced', num_steps=2000),
+    'sim_16': dict(kind='simulation', num_agents=16, drop_every=0, rgb_array=False, physics_preset='balanced', num_steps=1000),
+    'sim_64': dict(kind='simulation', num_agents=64, drop_every=0, rgb_array=False, physics_preset='balanced', num_steps=300),
+    'sim_16_droplets': dict(kind='simulation', num_agents=16, drop_every=20, rgb_array=False, physics_preset='balanced', num_steps=1000),
+    'sim_16_fast': dict(kind='simulation', num_agents=16, drop_every=20, rgb_array=False, physics_preset='fast', num_steps=1000),
+    'sim_16_accurate': dict(kind='simulation', num_agents=16, drop_every=20, rgb_array=False, physics_preset='accurate', num_steps=300),
+    'sim_1_rgb_array': dict(kind='simulation', num_agents=1, drop_every=0, rgb_array=True, physics_preset='balanced', num_steps=30),
+    'ot2env': dict(kind='ot2env', num_agents=1, drop_every=0, rgb_array=False, physics_preset='balanced', num_steps=2000),
+}
+
+
+def _random_actions(rng, num_agents, num_steps, drop_every, hold_steps=60):
+    actions = np.zeros((num_steps, num_agents, 4))
+    for start in range(0, num_steps, hold_steps):
+        actions[start:start + hold_steps, :, :3] = rng.uniform(-1, 1, size=(num_agents, 3))
+    if drop_every:
+        actions[::drop_every, :, 3] = 1
+    return actions
+
+
+def measure_scenario(kind, num_agents, drop_every, rgb_array, physics_preset, num_steps, repeats=DEFAULT_REPEATS, seed=0):
+    """Returns the median steps per second and reset latency in milliseconds of a scenario over repeats runs."""
+    actions = _random_actions(np.random.default_rng(seed), num_agents, num_steps, drop_every)
+    if kind == 'ot2env':
+        from ot2_gym_wrapper_2 import OT2Env
+        env = OT2Env(render=False, physics_preset=physics_preset)
+        env.reset(seed=seed)
+        step = lambda action: env.step(action[0, :3])
+        reset = lambda: env.reset()
+        close = env.close
+    else:
+        sim = Simulation(num_agents=num_agents, render=False, rgb_array=rgb_array, droplet_pool_size=num_agents,
+                         physics_preset=physics_preset, plate_id=0)
+        step = sim.run_array
+        reset = lambda: sim.reset(num_agents=num_agents)
+        close = sim.close
+
+    # an untimed warm-up run, the first reset after droplets grows the droplet pool and takes a new snapshot
+    for action in actions:
+        step(action)
+    reset()
+
+    steps_per_second = []
+    reset_ms = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for action in actions:
+            step(action)
+        steps_per_second.append(num_steps / (time.perf_counter() - start))
+        # the reset after a run with droplets in the world, as between two episodes
+        start = time.perf_counter()
+        reset()
+        reset_ms.append((time.perf_counter() - start) * 1000)
+    close()
+    return {"steps_per_second": float(np.median(steps_per_second)), "reset_ms": float(np.median(reset_ms))}
+
+
+def run_suite(names=None, repeats=DEFAULT_REPEATS):
+    return {name: measure_scenario(**SCENARIOS[name], repeats=repeats) for name in (names or SCENARIOS)}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns a message per measurement that is more than tolerance worse than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        stored = baseline[name]
+        if result['steps_per_second'] < stored['steps_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['steps_per_second']:.0f} steps/s, baseline {stored['steps_per_second']:.0f}")
+        if result['reset_ms'] > stored['reset_ms'] * (1 + tolerance) + RESET_SLACK_MS:
+            regressions.append(f"{name}: reset {result['reset_ms']:.2f} ms, baseline {stored['reset_ms']:.2f} ms")
+    return regressions
+
+
+def load_baseline(path=BASELINE_PATH):
+    """Returns the stored baseline with its results and repeat count, or None when there is no baseline of the current version."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        baseline = json.load(file)
+    if baseline.get('version') != BASELINE_VERSION:
+        return None
+    return baseline
+
+
+def save_baseline(results, repeats, path=BASELINE_PATH):
+    baseline = {
+        "version": BASELINE_VERSION,
+        "repeats": repeats,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(),
+                    "pybullet": p.getAPIVersion()},
+        "scenarios": {name: SCENARIOS[name] for name in results},
+        "results": results,
+    }
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=2)
+
+
+def main(args):
+    stored = load_baseline(args.baseline)
+    # a median over another number of runs is not comparable, check before spending time on the suite
+    if stored and not args.save and stored['repeats'] != args.repeats:
+        print(f"The baseline in {args.baseline} was measured with --repeats {stored['repeats']}, "
+              f"rerun with it or store a new baseline with --save")
+        return 2
+    results = run_suite(args.scenarios, args.repeats)
+    baseline = stored['results'] if stored else {}
+
+    print("--- Simulation throughput ---")
+    print(f"{'scenario':>16} {'steps/s':>9} {'baseline':>9} {'reset (ms)':>11} {'baseline':>9}")
+    for name, result in results.items():
+        stored = baseline.get(name, {})
+        print(f"{name:>16} {result['steps_per_second']:>9.0f} {stored.get('steps_per_second', float('nan')):>9.0f} "
+              f"{result['reset_ms']:>11.2f} {stored.get('reset_ms', float('nan')):>9.2f}")
+
+    if args.save:
+        save_baseline(results, args.repeats, args.baseline)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"No baseline of version {BASELINE_VERSION} in {args.baseline}, run with --save to store one")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=None, help="Scenarios to run, all by default")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="Runs per scenario after a warm-up run, the median counts")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -1,35 +1,128 @@
 import pybullet as p
+from pybullet_utils import bullet_client
 import time
 import pybullet_data
 import math
 import logging
 import os
-import random
+import weakref
+import numpy as np
+
+from camera import OffscreenCamera
+from robot_template import RobotTemplate
+from texture_library import PlateTextureLibrary
+from world_state import WorldState
+from droplet_log import DropletLog
+from profiler import StageProfiler
 
 #logging.basicConfig(level=logging.INFO)
 
+# the three prismatic joints of the gantry (x, y, z), the x and y joints move the pipette in the negative direction
+JOINT_INDICES = [0, 1, 2]
+JOINT_SIGNS = np.array([-1.0, -1.0, 1.0])
+JOINT_FORCES = [500, 500, 800]
+
+# lifecycle states of a droplet, only falling droplets are checked for contact
+DROPLET_FALLING = 0
+DROPLET_SETTLED = 1
+DROPLET_REMOVED = 2
+DROPLET_RADIUS = 0.003
+DROPLET_MASS = 0.1
+# unused droplet bodies wait here, below the plane and out of view
+DROPLET_PARK_POSITION = [0, 0, -10]
+DROPLET_POOL_CHUNK = 16
+# the robot and specimen urdfs next to this file, so the simulation does not depend on the working directory
+ROBOT_URDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ot_2_simulation_v6.urdf')
+SPECIMEN_URDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'custom.urdf')
+
+# collision groups, the robots and specimens of neighbouring grid cells get different cell groups
+# so the broadphase never pairs bodies of two different agents
+ENVIRONMENT_GROUP = 1
+DROPLET_GROUP = 2
+CELL_GROUPS = [4, 8, 16, 32]
+URDF_FLAGS = p.URDF_USE_INERTIA_FROM_FILE | p.URDF_ENABLE_CACHED_GRAPHICS_SHAPES
+
+# default physics frequency, pybullet's own default time step of 1/240 s
+PHYSICS_HZ = 240
+# named engine settings, balanced is pybullet's defaults
+# the time step stays 1/physics_hz for every preset, accurate splits each step into numSubSteps smaller solver steps
+PHYSICS_PRESETS = {
+    'fast': {'numSolverIterations': 5, 'numSubSteps': 0, 'solverResidualThreshold': 1e-4,
+             'contactBreakingThreshold': 0.005, 'enableConeFriction': 0},
+    'balanced': {'numSolverIterations': 50, 'numSubSteps': 0, 'solverResidualThreshold': 1e-7,
+                 'contactBreakingThreshold': 0.02, 'enableConeFriction': 1},
+    'accurate': {'numSolverIterations': 150, 'numSubSteps': 4, 'solverResidualThreshold': 1e-9,
+                 'contactBreakingThreshold': 0.02, 'enableConeFriction': 1},
+}
+
+# pybullet client that binds every pybullet function to its own physics server
+# the stock BulletClient builds a new partial on every call, here each function is bound once and cached on the instance
+class _PhysicsClient(bullet_client.BulletClient):
+    def __getattr__(self, name):
+        attribute = super().__getattr__(name)
+        # disconnect must keep going through BulletClient so it can mark the client as closed
+        if name != 'disconnect':
+            setattr(self, name, attribute)
+        return attribute
+
+# function to free the pybullet copy of a WorldState that was dropped without discard_state
+def _remove_bullet_state(simulation_ref, client_id, bullet_state_id):
+    simulation = simulation_ref()
+    # after close the client id can belong to another simulation
+    if simulation is not None and simulation.physicsClient == client_id:
+        simulation._p.removeState(bullet_state_id)
+
 class Simulation:
-    def __init__(self, num_agents, render=True, rgb_array=False):
+    # droplet_mode 'physics' drops a sphere that falls onto the specimen, 'instant' ray casts the landing point without a physics body
+    # droplet_pool_size droplet bodies are preallocated, the pool grows on demand when more droplets are in flight
+    # physics_hz is the physics step rate, actions are re-applied at control_hz and contacts and the camera are checked at sensor_hz
+    # control_hz and sensor_hz default to physics_hz and must divide it
+    # with rgb_array the offscreen camera renders on sensor ticks, camera_options are passed to OffscreenCamera (e.g. render_every, depth)
+    # the specimens get plate plate_id, or a random plate drawn with texture_seed, preload_textures loads every plate texture up front
+    # physics_preset picks the solver settings from PHYSICS_PRESETS
+    # texture_cache_dir keeps decoded copies of the textures on disk for faster start up, see PlateTextureLibrary
+    # with profile the time spent in every stage of a step is counted, see stats
+    def __init__(self, num_agents, render=True, rgb_array=False, droplet_mode='physics', droplet_pool_size=0,
+                 physics_hz=PHYSICS_HZ, control_hz=None, sensor_hz=None, camera_options=None,
+                 plate_id=None, texture_seed=None, preload_textures=False, physics_preset='balanced',
+                 texture_cache_dir=None, profile=False):
+        if droplet_mode not in ('physics', 'instant'):
+            raise ValueError(f"droplet_mode must be 'physics' or 'instant', got {droplet_mode!r}")
+        if physics_preset not in PHYSICS_PRESETS:
+            raise ValueError(f"physics_preset must be one of {list(PHYSICS_PRESETS)}, got {physics_preset!r}")
+        self.physics_preset = physics_preset
+        self.physics_hz = physics_hz
+        self.control_hz = control_hz or physics_hz
+        self.sensor_hz = sensor_hz or physics_hz
+        # number of physics substeps between two control updates and between two sensor updates
+        self.control_interval = self._substep_interval('control_hz', self.control_hz)
+        self.sensor_interval = self._substep_interval('sensor_hz', self.sensor_hz)
+        # physics steps taken since the simulation was created, the control and sensor ticks are counted from here
+        self.physics_step = 0
+        # per-stage timings, None unless profiling
+        self.profiler = StageProfiler() if profile else None
         self.render = render
         self.rgb_array = rgb_array
+        self.droplet_mode = droplet_mode
         if render:
             mode = p.GUI # for graphical version
         else:
             mode = p.DIRECT # for non-graphical version
-        # Set up the simulation
-        self.physicsClient = p.connect(mode)
+        # Set up the simulation, every pybullet call goes through this client so several simulations can share a process
+        self._p = _PhysicsClient(connection_mode=mode)
+        self.physicsClient = self._p._client
         # Hide the default GUI components
-        p.configureDebugVisualizer(p.COV_ENABLE_GUI, 0)
-        p.setAdditionalSearchPath(pybullet_data.getDataPath()) #optionally
-        p.setGravity(0,0,-10)
-        #p.setPhysicsEngineParameter(contactBreakingThreshold=0.000001)
-        # load a texture
-        texture_list = os.listdir("textures")
-        random_texture = random.choice(texture_list[:-1])
-        random_texture_index = texture_list.index(random_texture)
-        self.plate_image_path = f'textures/_plates/{os.listdir("textures/_plates")[random_texture_index]}'
-        self.textureId = p.loadTexture(f'textures/{random_texture}')
-        #print(f'textureId: {self.textureId}')
+        self._p.configureDebugVisualizer(p.COV_ENABLE_GUI, 0)
+        self._p.setAdditionalSearchPath(pybullet_data.getDataPath()) #optionally
+        self._p.setGravity(0,0,-10)
+        self._p.setTimeStep(1./physics_hz)
+        self._p.setPhysicsEngineParameter(**PHYSICS_PRESETS[physics_preset])
+        # load a texture, the library keeps every loaded plate texture for set_plate
+        self.textures = PlateTextureLibrary(self._p, seed=texture_seed, preload=preload_textures,
+                                            cache_dir=texture_cache_dir)
+        self.plate_id = self.textures.random_plate() if plate_id is None else plate_id
+        self.textureId = self.textures.texture_id(self.plate_id)
+        self.plate_image_path = self.textures.plate_image_path(self.plate_id)
 
         # Set the camera parameters
         cameraDistance = 1.1*(math.ceil((num_agents)**0.3)) # Distance from the target (zoom)
@@ -38,38 +131,71 @@ class Simulation:
         cameraTargetPosition = [-0.2, -(math.ceil(num_agents**0.5)/2)+0.5, 0.1]  # XYZ coordinates of the target position
 
         # Reset the camera with the specified parameters
-        p.resetDebugVisualizerCamera(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition)
+        self._p.resetDebugVisualizerCamera(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition)
 
-        self.baseplaneId = p.loadURDF("plane.urdf")
+        self.baseplaneId = self._p.loadURDF("plane.urdf")
+        # pybullet lets two bodies collide when either group matches the other's mask, so the plane must leave the cell groups out of its mask
+        self._p.setCollisionFilterGroupMask(self.baseplaneId, -1, ENVIRONMENT_GROUP, ENVIRONMENT_GROUP | DROPLET_GROUP)
         # add collision shape to the plane
-        #p.createCollisionShape(shapeType=p.GEOM_BOX, halfExtents=[30, 305, 0.001])
+        #self._p.createCollisionShape(shapeType=p.GEOM_BOX, halfExtents=[30, 305, 0.001])
 
         # define the pipette offset
         self.pipette_offset = [0.073, 0.0895, 0.0895]
         # dictionary to keep track of the current pipette position per robot
         self.pipette_positions = {}
 
+        # the first robot is loaded from the urdf, the others are copies that share its shapes
+        self._robot_template = None
+        # number of worlds built so far, captured states only fit the world they were taken from
+        self._generation = 0
+
         # Create the robots
         self.create_robots(num_agents)
 
         # list of sphere ids
         self.sphereIds = []
-
-        # dictionary to keep track of the droplet positions on specimens key for specimenId, list of droplet positions
-        self.droplet_positions = {}
+        # lifecycle state per sphere id (DROPLET_FALLING, DROPLET_SETTLED or DROPLET_REMOVED)
+        self.droplet_states = {}
+        # active set of falling droplets, sphere id -> id of the robot that dropped it
+        self.falling_droplets = {}
+        # settled droplets, sphere id -> (constraint id, specimen id)
+        self._droplet_constraints = {}
+        # droplet bodies share one visual and collision shape, unused bodies wait parked in the pool
+        self._droplet_visual_shape = None
+        self._droplet_collision_shape = None
+        self._droplet_pool = []
+        self._num_droplet_bodies = 0
+        if droplet_mode == 'physics' and droplet_pool_size > 0:
+            self._grow_droplet_pool(droplet_pool_size)
+
+        # every droplet that landed on a specimen or hit a robot, see droplet_positions for the positions per specimen
+        self.droplet_log = DropletLog()
+
+        # in-memory snapshot of the world right after construction, restored by reset
+        self._snapshot_id = None
+        self._take_snapshot()
+
+        # offscreen camera, created on the first capture_frame call when rgb_array is off
+        self.camera_options = dict(camera_options or {})
+        self.camera = OffscreenCamera(self._p, **self.camera_options) if rgb_array else None
+        self.current_frame = None
+        # physics step current_frame was rendered on, -1 before the first frame
+        self.frame_step = -1
+        # functions called with the simulation after every physics step, e.g. VideoRecorder.on_step
+        self.step_callbacks = []
 
         # Function to compute view matrix based on these parameters
         # def compute_camera_view(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition):
         #     camUpVector = (0, 0, 1)  # Up vector in Z-direction
         #     camForward = (1, 0, 0)  # Forward vector in X-direction
         #     camTargetPos = cameraTargetPosition
-        #     camPos = p.multiplyTransforms(camTargetPos, p.getQuaternionFromEuler((0, 0, 0)), (0, 0, cameraDistance), p.getQuaternionFromEuler((cameraPitch, 0, cameraYaw)))[0]
-        #     viewMatrix = p.computeViewMatrix(camPos, camTargetPos, camUpVector)
+        #     camPos = self._p.multiplyTransforms(camTargetPos, self._p.getQuaternionFromEuler((0, 0, 0)), (0, 0, cameraDistance), self._p.getQuaternionFromEuler((cameraPitch, 0, cameraYaw)))[0]
+        #     viewMatrix = self._p.computeViewMatrix(camPos, camTargetPos, camUpVector)
         #     return viewMatrix
         
         # Capture the image
         #self.view_matrix = compute_camera_view(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition)
-        #.projection_matrix = p.computeProjectionMatrixFOV(fov=60, aspect=640/480, nearVal=0.1, farVal=100)
+        #.projection_matrix = self._p.computeProjectionMatrixFOV(fov=60, aspect=640/480, nearVal=0.1, farVal=100)
 
     # method to create n robots in a grid pattern
     def create_robots(self, num_agents):
@@ -80,65 +206,68 @@ class Simulation:
 
         self.robotIds = []
         self.specimenIds = []
+        # plate id per specimen id, set_plate can give single specimens a plate of their own
+        self.specimen_plates = {}
+        # poses right after loading, used to put the robots back when the snapshot cannot be restored
+        self._robot_start_poses = []
+        self._specimen_start_poses = []
         agent_count = 0  # Counter for the number of placed agents
 
+        # preallocated (N,3) arrays for the array based api, the base positions never change as the robots are fixed in space
+        self.base_position_array = np.zeros((num_agents, 3))
+        self.joint_position_array = np.zeros((num_agents, 3))
+        self.joint_velocity_array = np.zeros((num_agents, 3))
+        self.pipette_position_array = np.zeros((num_agents, 3))
+        # last commanded joint velocities, pybullet does not report motor targets back
+        self._target_velocities = np.zeros((num_agents, 3))
+        self._generation += 1
+
+        # nothing is drawn while the world is built, which keeps the GUI from redrawing after every body
+        self._p.configureDebugVisualizer(p.COV_ENABLE_RENDERING, 0)
         for i in range(grid_size):
             for j in range(grid_size):
                 if agent_count < num_agents:  # Check if more agents need to be placed
                     # Calculate position for each robot
                     position = [-spacing * i, -spacing * j, 0.03]
-                    robotId = p.loadURDF("ot_2_simulation_v6.urdf", position, [0,0,0,1],
-                                        flags=p.URDF_USE_INERTIA_FROM_FILE)
-                    start_position, start_orientation = p.getBasePositionAndOrientation(robotId)
-                    p.createConstraint(parentBodyUniqueId=robotId,
-                                    parentLinkIndex=-1,
-                                    childBodyUniqueId=-1,
-                                    childLinkIndex=-1,
-                                    jointType=p.JOINT_FIXED,
-                                    jointAxis=[0, 0, 0],
-                                    parentFramePosition=[0, 0, 0],
-                                    childFramePosition=start_position,
-                                    childFrameOrientation=start_orientation)
-
-                    # Create a fixed constraint between the robot and the base plane so the robot is fixed in space above the plane by its base link with an offset
-                    #p.createConstraint(self.baseplaneId, -1, robotId, -1, p.JOINT_FIXED, [0, 0, 0], position, [0, 0, 0])
+                    # the base is fixed in space by pybullet itself, no constraint to solve every step
+                    if self._robot_template is None:
+                        robotId = self._p.loadURDF(ROBOT_URDF_PATH, position, [0,0,0,1],
+                                            useFixedBase=True, flags=URDF_FLAGS)
+                        self._robot_template = RobotTemplate(self._p, ROBOT_URDF_PATH, robotId)
+                    else:
+                        robotId = self._robot_template.spawn(position)
+                    start_position, start_orientation = self._p.getBasePositionAndOrientation(robotId)
 
                     # Load the specimen with an offset
                     offset = [0.18275-0.00005, 0.163-0.026, 0.057]
                     position_with_offset = [position[0] + offset[0], position[1] + offset[1], position[2] + offset[2]]
-                    rotate_90 = p.getQuaternionFromEuler([0, 0, -math.pi/2])
-                    planeId = p.loadURDF("custom.urdf", position_with_offset, rotate_90)#start_orientation)
+                    rotate_90 = self._p.getQuaternionFromEuler([0, 0, -math.pi/2])
+                    planeId = self._p.loadURDF(SPECIMEN_URDF_PATH, position_with_offset, rotate_90, useFixedBase=True, flags=URDF_FLAGS)
                     # Disable collision between the robot and the specimen
-                    p.setCollisionFilterPair(robotId, planeId, -1, -1, enableCollision=0)
-                    spec_position, spec_orientation = p.getBasePositionAndOrientation(planeId)
-
-                    #Constrain the specimen to the robot
-                    # p.createConstraint(parentBodyUniqueId=robotId,
-                    #                 parentLinkIndex=-1,
-                    #                 childBodyUniqueId=planeId,
-                    #                 childLinkIndex=-1,
-                    #                 jointType=p.JOINT_FIXED,
-                    #                 jointAxis=[0, 0, 0],
-                    #                 parentFramePosition=start_position,
-                    #                 #parentFrameOrientation=start_orientation,
-                    #                 childFramePosition=[0, 0, 0],
-                    #                 childFrameOrientation=[0, 0, 0, 1])
-                    #p.createConstraint(robotId, -1, planeId, -1, p.JOINT_FIXED, [0, 0, 0], offset, [0, 0, 0])
-                    p.createConstraint(parentBodyUniqueId=planeId,
-                                    parentLinkIndex=-1,
-                                    childBodyUniqueId=-1,
-                                    childLinkIndex=-1,
-                                    jointType=p.JOINT_FIXED,
-                                    jointAxis=[0, 0, 0],
-                                    parentFramePosition=[0, 0, 0],
-                                    childFramePosition=spec_position,
-                                    childFrameOrientation=spec_orientation)
+                    self._p.setCollisionFilterPair(robotId, planeId, -1, -1, enableCollision=0)
+                    spec_position, spec_orientation = self._p.getBasePositionAndOrientation(planeId)
+
+                    # robot and specimen only collide with the droplets and bodies of the same cell group
+                    # both are fixed in space, so they never need to touch the plane either
+                    # pybullet casts rays with the environment group, so both keep it in their mask for the instant droplet mode,
+                    # the plane's mask leaves out the cell groups so no contacts with the plane come of it
+                    cell_group = CELL_GROUPS[2 * (i % 2) + j % 2]
+                    cell_mask = DROPLET_GROUP | cell_group | ENVIRONMENT_GROUP
+                    for linkIndex in [-1] + JOINT_INDICES:
+                        self._p.setCollisionFilterGroupMask(robotId, linkIndex, cell_group, cell_mask)
+                        # pybullet lets a pair through when either side's mask holds the other's group, which would pair the moving links with the plane
+                        self._p.setCollisionFilterPair(robotId, self.baseplaneId, linkIndex, -1, enableCollision=0)
+                    self._p.setCollisionFilterGroupMask(planeId, -1, cell_group, cell_mask)
+
                     # Load your texture and apply it to the plane
-                    #textureId = p.loadTexture("uvmapped_dish_large_comp.png")
-                    p.changeVisualShape(planeId, -1, textureUniqueId=self.textureId)
+                    self._p.changeVisualShape(planeId, -1, textureUniqueId=self.textureId)
+                    self.specimen_plates[planeId] = self.plate_id
 
                     self.robotIds.append(robotId)
                     self.specimenIds.append(planeId)
+                    self.base_position_array[agent_count] = start_position
+                    self._robot_start_poses.append((start_position, start_orientation))
+                    self._specimen_start_poses.append((spec_position, spec_orientation))
 
                     agent_count += 1  # Increment the agent counter
 
@@ -146,13 +275,22 @@ class Simulation:
                     pipette_position = self.get_pipette_position(robotId)
                     # save the pipette position
                     self.pipette_positions[f'robotId_{robotId}'] = pipette_position
+        self._p.configureDebugVisualizer(p.COV_ENABLE_RENDERING, 1)
+
+        # position of the pipette when all joints are at zero, the joint positions are added to this with JOINT_SIGNS
+        self.pipette_origin_array = self.base_position_array + self.pipette_offset
+
+    # method to get the (3,) lower and upper limits of the x, y and z joints from the robot urdf
+    def joint_limits(self):
+        infos = [self._p.getJointInfo(self.robotIds[0], jointIndex) for jointIndex in JOINT_INDICES]
+        return np.array([info[8] for info in infos]), np.array([info[9] for info in infos])
 
     # method to get the current pipette position for a robot
     def get_pipette_position(self, robotId):
         #get the position of the robot
-        robot_position = p.getBasePositionAndOrientation(robotId)[0]
+        robot_position = self._p.getBasePositionAndOrientation(robotId)[0]
         robot_position = list(robot_position)
-        joint_states = p.getJointStates(robotId, [0, 1, 2])
+        joint_states = self._p.getJointStates(robotId, [0, 1, 2])
         robot_position[0] -= joint_states[0][0]
         robot_position[1] -= joint_states[1][0]
         robot_position[2] += joint_states[2][0]
@@ -165,143 +303,354 @@ class Simulation:
         return pipette_position
 
     # method to reset the simulation
+    # with the same number of agents the world is restored from the in-memory snapshot taken after construction,
+    # only a different number of agents rebuilds the robots
     def reset(self, num_agents=1):
+        # Return the spheres to the droplet pool before their specimens are removed
+        for sphereId in self.sphereIds:
+            self._release_droplet(sphereId)
+
+        # list of sphere ids
+        self.sphereIds = []
+        self.droplet_states = {}
+        self.falling_droplets = {}
+        self.droplet_log.clear()
+
+        if num_agents == len(self.robotIds):
+            self._restore_snapshot()
+            return self.get_states()
+
         # Remove the textures from the specimens
         for specimenId in self.specimenIds:
-            p.changeVisualShape(specimenId, -1, textureUniqueId=-1)
+            self._p.changeVisualShape(specimenId, -1, textureUniqueId=-1)
 
-        # Remove the robots
+        # Remove the robots and the specimens
         for robotId in self.robotIds:
-            p.removeBody(robotId)
-            # remove the robotId from the list of robotIds
-            self.robotIds.remove(robotId)
-
-        # Remove the specimens
+            self._p.removeBody(robotId)
         for specimenId in self.specimenIds:
-            p.removeBody(specimenId)
-            # remove the specimenId from the list of specimenIds
-            self.specimenIds.remove(specimenId)
-
-        # Remove the spheres
-        for sphereId in self.sphereIds:
-            p.removeBody(sphereId)
-            # remove the sphereId from the list of sphereIds
-            self.sphereIds.remove(sphereId)
+            self._p.removeBody(specimenId)
 
         # dictionary to keep track of the current pipette position per robot
         self.pipette_positions = {}
-        # list of sphere ids
-        self.sphereIds = []
-        # dictionary to keep track of the droplet positions on specimens key for specimenId, list of droplet positions
-        self.droplet_positions = {}
 
         # Create the robots
         self.create_robots(num_agents)
+        self._take_snapshot()
 
         return self.get_states()
 
-    # method to run the simulation for a specified number of steps
+    # method to save the state of the freshly built world in memory, used by reset instead of reloading the robots
+    def _take_snapshot(self):
+        if self._snapshot_id is not None:
+            self._p.removeState(self._snapshot_id)
+        self._snapshot_id = self._p.saveState()
+        self._snapshot_body_count = self._body_count()
+
+    # method to bring the robots back to the snapshot, the droplets must already be back in the pool
+    def _restore_snapshot(self):
+        # restoreState needs the same bodies as when the snapshot was taken, which no longer holds once the droplet pool has grown
+        if self._body_count() == self._snapshot_body_count:
+            self._p.restoreState(self._snapshot_id)
+        else:
+            for robotId, specimenId, robot_pose, specimen_pose in zip(self.robotIds, self.specimenIds, self._robot_start_poses, self._specimen_start_poses):
+                for jointIndex in JOINT_INDICES:
+                    self._p.resetJointState(robotId, jointIndex, targetValue=0, targetVelocity=0)
+                self._p.resetBasePositionAndOrientation(robotId, *robot_pose)
+                self._p.resetBaseVelocity(robotId, [0, 0, 0], [0, 0, 0])
+                self._p.resetBasePositionAndOrientation(specimenId, *specimen_pose)
+                self._p.resetBaseVelocity(specimenId, [0, 0, 0], [0, 0, 0])
+            self._take_snapshot()
+        # restoreState does not cover the motors, stop them as a freshly loaded robot would be
+        self._target_velocities[:] = 0
+        for robotId in self.robotIds:
+            self._p.setJointMotorControlArray(robotId, JOINT_INDICES, p.VELOCITY_CONTROL,
+                                        targetVelocities=[0, 0, 0], forces=JOINT_FORCES)
+
+    # method to put a single robot back at its start position, the other robots and the droplets are left as they are
+    def reset_robot(self, index):
+        robotId = self.robotIds[index]
+        for jointIndex in JOINT_INDICES:
+            self._p.resetJointState(robotId, jointIndex, targetValue=0, targetVelocity=0)
+        self._target_velocities[index] = 0
+        self._p.setJointMotorControlArray(robotId, JOINT_INDICES, p.VELOCITY_CONTROL,
+                                          targetVelocities=[0, 0, 0], forces=JOINT_FORCES)
+
+    # method to check that a control or sensor rate divides the physics rate, returns the number of substeps per tick
+    def _substep_interval(self, name, hz):
+        interval = self.physics_hz / hz
+        if hz <= 0 or hz > self.physics_hz or interval != int(interval):
+            raise ValueError(f"{name} must divide physics_hz ({self.physics_hz}), got {hz}")
+        return int(interval)
+
+    # method to count the bodies in the world, pybullet's getNumBodies does not include batch created bodies
+    def _body_count(self):
+        return 1 + len(self.robotIds) + len(self.specimenIds) + self._num_droplet_bodies
+
+    # method to run the simulation for a specified number of physics steps
+    # the actions are applied on the first step and re-applied on every control tick, a held drop command drops once per tick
     def run(self, actions, num_steps=1):
-        #self.apply_actions(actions)
-        start = time.time()
-        n = 100
+        self._run_steps(self.apply_actions, actions, num_steps)
+        return self.get_states()
+
+    # method to run the simulation with an (N,4) array of actions, returns the preallocated state arrays instead of the states dictionary
+    def run_array(self, actions, num_steps=1):
+        actions = np.asarray(actions, dtype=np.float64)
+        self._run_steps(self.apply_actions_array, actions, num_steps)
+        return self.get_state_arrays()
+
+    # method to step the physics, shared by run and run_array
+    def _run_steps(self, apply_actions, actions, num_steps):
+        profiler = self.profiler
         for i in range(num_steps):
-            self.apply_actions(actions)
-            p.stepSimulation()
-
-            # reset the droplet after 20 steps
-            # if self.dropped:
-            #     self.cooldown += 1
-            #     if self.cooldown == self.cooldown_time:
-            #         self.dropped = False
-            #         self.cooldown = 0                
-
-            #compute and display the frames per second every n steps
-            # if i % n == 0:
-            #     fps = n / (time.time() - start)
-            #     start = time.time()
-            #     print(f'fps: {fps}')
-                # #print the orientation of the robot every n steps
-                # for i in range(len(self.robotIds)):
-                #     orientation = p.getBasePositionAndOrientation(self.robotIds[i])[1]
-                #     #print(f'robot {i} orientation: {orientation}')
-                #     #get the position of the link on the z axis
-                #     link_state = p.getLinkState(self.robotIds[i], 0)
-                #     print(f'robot {i} link_state: {link_state}')
-            # check contact for each robot and specimen
-            for specimenId, robotId in zip(self.specimenIds, self.robotIds):
-                #logging.info(f'checking contact for robotId: {robotId}, specimenId: {specimenId}')
-                self.check_contact(robotId, specimenId)
-
-            if self.rgb_array:
-                # Camera parameters
-                camera_pos = [1, 0, 1] # Example position
-                camera_target = [-0.3, 0, 0] # Point where the camera is looking at
-                up_vector = [0, 0, 1] # Usually the Z-axis is up
-                fov = 50 # Field of view
-                aspect = 320/240 # Aspect ratio (width/height)
-
-                # Get camera image
-                width, height, rgbImg, depthImg, segImg = p.getCameraImage(width=320, height=240, viewMatrix=p.computeViewMatrix(camera_pos, camera_target, up_vector), projectionMatrix=p.computeProjectionMatrixFOV(fov, aspect, 0.1, 100.0))
-                
-                self.current_frame = rgbImg  # RGB array
-                #print(self.current_frame)
-
-            if self.render:
-                time.sleep(1./240.) # slow down the simulation
+            # the motor targets persist in pybullet between steps, so in between control ticks there is nothing to apply
+            if i == 0 or self.physics_step % self.control_interval == 0:
+                start = time.perf_counter_ns() if profiler else 0
+                apply_actions(actions)
+                if profiler:
+                    profiler.lap('apply_actions', start)
+            self._physics_step()
+
+    # method to advance the physics by one step and run the sensors and step callbacks that fall on it
+    def _physics_step(self):
+        profiler = self.profiler
+        start = time.perf_counter_ns() if profiler else 0
+        self._p.stepSimulation()
+        self.physics_step += 1
+        if profiler:
+            start = profiler.lap('step_simulation', start)
+
+        if self.physics_step % self.sensor_interval == 0:
+            self._sense()
+            if profiler:
+                start = time.perf_counter_ns()
+        if self.step_callbacks:
+            # a callback can run profiled stages itself, e.g. the recorder renders with capture_frame
+            nested_start = profiler.profiled_ns if profiler else 0
+            for callback in self.step_callbacks:
+                callback(self)
+            if profiler:
+                start = profiler.lap('step_callbacks', start, profiler.profiled_ns - nested_start)
+
+        if self.render:
+            time.sleep(1./self.physics_hz) # slow down the simulation
+            if profiler:
+                profiler.lap('render_sleep', start)
+
+    # method to hold one (N,4) array of actions until every pipette is within tolerance of target, every joint is slower than velocity_epsilon
+    # or max_steps physics steps have run, whichever comes first, target is an (N,3) array or one position for all robots
+    # the actions are applied once, so a droplet is only dropped on the first step
+    # returns the states dictionary and the (steps, N, 3) pipette positions after every step
+    def run_until(self, actions, target=None, tolerance=0.001, velocity_epsilon=None, max_steps=1000):
+        if max_steps < 1:
+            raise ValueError(f"max_steps must be at least 1, got {max_steps}")
+        num_agents = len(self.robotIds)
+        actions = np.asarray(actions, dtype=np.float64).reshape(num_agents, 4)
+        if target is not None:
+            target = np.broadcast_to(np.asarray(target, dtype=np.float64), (num_agents, 3))
+        trajectory = np.empty((max_steps, num_agents, 3))
+
+        start = time.perf_counter_ns() if self.profiler else 0
+        self.apply_actions_array(actions)
+        if self.profiler:
+            self.profiler.lap('apply_actions', start)
+        for step in range(max_steps):
+            self._physics_step()
+            _, joint_velocities, pipette_positions = self.get_state_arrays()
+            trajectory[step] = pipette_positions
+            if target is not None and (np.linalg.norm(pipette_positions - target, axis=1) <= tolerance).all():
+                break
+            if velocity_epsilon is not None and (np.abs(joint_velocities) < velocity_epsilon).all():
+                break
+        return self.get_states(), trajectory[:step + 1]
+
+    # method to run the contact checks and the camera, called on every sensor tick
+    def _sense(self):
+        profiler = self.profiler
+        start = time.perf_counter_ns() if profiler else 0
+        # check contact of the falling droplets with the specimens and robots
+        self.check_contacts()
+        if profiler:
+            start = profiler.lap('check_contacts', start)
+
+        if self.rgb_array:
+            frame_count = self.camera.frame_count
+            self.camera.tick()
+            self.current_frame = self.camera.latest_frame()  # RGB array
+            if self.camera.frame_count != frame_count:
+                self.frame_step = self.physics_step
+            if profiler:
+                profiler.lap('camera', start)
+
+    # method to render a camera frame on request, returns the (height, width, 3) uint8 rgb frame
+    def capture_frame(self):
+        if self.camera is None:
+            # only render when asked to
+            self.camera = OffscreenCamera(self._p, **{**self.camera_options, 'render_every': 0})
+        start = time.perf_counter_ns() if self.profiler else 0
+        self.current_frame = self.camera.capture()
+        self.frame_step = self.physics_step
+        if self.profiler:
+            self.profiler.lap('camera', start)
+        return self.current_frame
+
+    # method to get the per-stage timings of a Simulation created with profile=True, see StageProfiler.stats
+    def stats(self):
+        if self.profiler is None:
+            raise ValueError("profiling is off, create the Simulation with profile=True")
+        return self.profiler.stats()
+
+    # method to write stats to a JSON file
+    def dump_stats(self, path):
+        if self.profiler is None:
+            raise ValueError("profiling is off, create the Simulation with profile=True")
+        self.profiler.dump(path)
+
+    # method to clear the timings, e.g. after warming up
+    def reset_stats(self):
+        if self.profiler is not None:
+            self.profiler.reset()
 
-        return self.get_states()
-    
     # method to apply actions to the robots using velocity control
     def apply_actions(self, actions): # actions [[x,y,z,drop], [x,y,z,drop], ...
         for i in range(len(self.robotIds)):
-            p.setJointMotorControl2(self.robotIds[i], 0, p.VELOCITY_CONTROL, targetVelocity=-actions[i][0], force=500)
-            p.setJointMotorControl2(self.robotIds[i], 1, p.VELOCITY_CONTROL, targetVelocity=-actions[i][1], force=500)
-            p.setJointMotorControl2(self.robotIds[i], 2, p.VELOCITY_CONTROL, targetVelocity=actions[i][2], force=800)
+            self._p.setJointMotorControl2(self.robotIds[i], 0, p.VELOCITY_CONTROL, targetVelocity=-actions[i][0], force=500)
+            self._p.setJointMotorControl2(self.robotIds[i], 1, p.VELOCITY_CONTROL, targetVelocity=-actions[i][1], force=500)
+            self._p.setJointMotorControl2(self.robotIds[i], 2, p.VELOCITY_CONTROL, targetVelocity=actions[i][2], force=800)
+            self._target_velocities[i] = [-actions[i][0], -actions[i][1], actions[i][2]]
             if actions[i][3] == 1:
                 self.drop(robotId=self.robotIds[i])
                 #logging.info(f'drop: {i}')
 
+    # method to apply an (N,4) array of actions, one motor call per robot instead of one per joint
+    def apply_actions_array(self, actions): # actions ndarray of shape (N, 4) [x,y,z,drop]
+        target_velocities = actions[:, :3] * JOINT_SIGNS
+        self._target_velocities[:] = target_velocities
+        for i, robotId in enumerate(self.robotIds):
+            self._p.setJointMotorControlArray(robotId, JOINT_INDICES, p.VELOCITY_CONTROL,
+                                        targetVelocities=target_velocities[i], forces=JOINT_FORCES)
+        drop_indices = np.flatnonzero(actions[:, 3] == 1)
+        if len(drop_indices):
+            self.drop_many([self.robotIds[i] for i in drop_indices])
+
     # method to drop a simulated droplet on the specimen from the pipette
     def drop(self, robotId):
-        # Get the position of the pipette based on the x,y,z coordinates of the joints
-        #robot_position = [0, 0, 0]
-        #get the position of the robot
-        robot_position = p.getBasePositionAndOrientation(robotId)[0]
-        robot_position = list(robot_position)
-        joint_states = p.getJointStates(robotId, [0, 1, 2])
-        robot_position[0] -= joint_states[0][0]
-        robot_position[1] -= joint_states[1][0]
-        robot_position[2] += joint_states[2][0]
-        # x,y offset
-        x_offset = self.pipette_offset[0]
-        y_offset = self.pipette_offset[1]
-        z_offset = self.pipette_offset[2]-0.0015
-        # Get the position of the specimen
-        specimen_position = p.getBasePositionAndOrientation(self.specimenIds[0])[0]
-        #logging.info(f'droplet_position: {droplet_position}')
-        # Create a sphere to represent the droplet
-        sphereRadius = 0.003  # Adjust as needed
-        sphereColor = [1, 0, 0, 0.5]  # RGBA (Red in this case)
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_SPHERE, radius=sphereRadius, rgbaColor=sphereColor)
-        #add collision to the sphere
-        collision = p.createCollisionShape(shapeType=p.GEOM_SPHERE, radius=sphereRadius)
-        sphereBody = p.createMultiBody(baseMass=0.1, baseVisualShapeIndex=visualShapeId, baseCollisionShapeIndex=collision)
-        # Calculate the position of the droplet at the tip of the pipette but at the same z coordinate as the specimen
-        droplet_position = [robot_position[0]+x_offset, robot_position[1]+y_offset, robot_position[2]+z_offset]
-                            #specimen_position[2] + sphereRadius+0.015/2+0.06]
-        p.resetBasePositionAndOrientation(sphereBody, droplet_position, [0, 0, 0, 1])
-        # track the sphere id
-        self.sphereIds.append(sphereBody)
+        droplet_position = self._droplet_start_position(robotId)
+        # in instant mode the landing point is found with a ray cast, no physics body is created
+        if self.droplet_mode == 'instant':
+            self._land_droplets([robotId], [droplet_position])
+            return droplet_position
+
+        # Take a sphere from the droplet pool to represent the droplet
+        sphereBody = self._acquire_droplet_bodies(1)[0]
+        self._launch_droplet(sphereBody, robotId, droplet_position)
         self.dropped = True
         #TODO: add some randomness to the droplet position proportional to the height of the pipette above the specimen and the velocity of the pipette of the pipette
         return droplet_position
 
+    # method to drop a droplet from several robots at once, instant mode casts all rays in one batch
+    def drop_many(self, robotIds):
+        if self.droplet_mode == 'instant':
+            droplet_positions = [self._droplet_start_position(robotId) for robotId in robotIds]
+            self._land_droplets(robotIds, droplet_positions)
+            return droplet_positions
+        # take all spheres from the pool at once so that a pool refill is a single batched creation
+        droplet_positions = [self._droplet_start_position(robotId) for robotId in robotIds]
+        sphereBodies = self._acquire_droplet_bodies(len(robotIds))
+        for sphereBody, robotId, droplet_position in zip(sphereBodies, robotIds, droplet_positions):
+            self._launch_droplet(sphereBody, robotId, droplet_position)
+        self.dropped = True
+        return droplet_positions
+
+    # method to take droplet bodies from the pool, the pool is refilled in one batched createMultiBody call when it runs out
+    def _acquire_droplet_bodies(self, count):
+        if count == 0:
+            return []
+        missing = count - len(self._droplet_pool)
+        if missing > 0:
+            self._grow_droplet_pool(max(missing, DROPLET_POOL_CHUNK))
+        sphereBodies = self._droplet_pool[-count:]
+        del self._droplet_pool[-count:]
+        return sphereBodies
+
+    # method to preallocate droplet bodies, they share the cached sphere shapes and are parked off-scene until used
+    def _grow_droplet_pool(self, count):
+        if self._droplet_visual_shape is None:
+            sphereColor = [1, 0, 0, 0.5]  # RGBA (Red in this case)
+            self._droplet_visual_shape = self._p.createVisualShape(shapeType=p.GEOM_SPHERE, radius=DROPLET_RADIUS, rgbaColor=sphereColor)
+            #add collision to the sphere
+            self._droplet_collision_shape = self._p.createCollisionShape(shapeType=p.GEOM_SPHERE, radius=DROPLET_RADIUS)
+        sphereBodies = self._p.createMultiBody(baseMass=DROPLET_MASS, baseVisualShapeIndex=self._droplet_visual_shape,
+                                         baseCollisionShapeIndex=self._droplet_collision_shape,
+                                         batchPositions=[DROPLET_PARK_POSITION] * count)
+        # a batch of one returns a single id instead of a tuple
+        if isinstance(sphereBodies, int):
+            sphereBodies = [sphereBodies]
+        for sphereBody in sphereBodies:
+            self._park_droplet(sphereBody)
+        self._droplet_pool.extend(sphereBodies)
+        self._num_droplet_bodies += len(sphereBodies)
+
+    # method to park a droplet body off-scene, static and without collisions so it costs nothing in the physics step
+    def _park_droplet(self, sphereBody):
+        self._p.changeDynamics(sphereBody, -1, mass=0)
+        self._p.setCollisionFilterGroupMask(sphereBody, -1, 0, 0)
+        self._p.resetBasePositionAndOrientation(sphereBody, DROPLET_PARK_POSITION, [0, 0, 0, 1])
+        self._p.resetBaseVelocity(sphereBody, [0, 0, 0], [0, 0, 0])
+
+    # method to release a parked droplet body at the pipette tip
+    def _launch_droplet(self, sphereBody, robotId, droplet_position):
+        self._p.changeDynamics(sphereBody, -1, mass=DROPLET_MASS)
+        self._p.setCollisionFilterGroupMask(sphereBody, -1, DROPLET_GROUP, -1)
+        self._p.resetBasePositionAndOrientation(sphereBody, droplet_position, [0, 0, 0, 1])
+        # track the sphere id
+        self.sphereIds.append(sphereBody)
+        self.droplet_states[sphereBody] = DROPLET_FALLING
+        self.falling_droplets[sphereBody] = robotId
+
+    # method to return a droplet body to the pool, undoing the constraint and collision filter of a settled droplet
+    def _release_droplet(self, sphereId):
+        if sphereId in self._droplet_constraints:
+            constraintId, specimenId = self._droplet_constraints.pop(sphereId)
+            self._p.removeConstraint(constraintId)
+            self._p.setCollisionFilterPair(sphereId, specimenId, -1, -1, enableCollision=1)
+        self._park_droplet(sphereId)
+        self._droplet_pool.append(sphereId)
+
+    # method to get the position a droplet is released from, just below the tip of the pipette
+    def _droplet_start_position(self, robotId):
+        droplet_position = self.get_pipette_position(robotId)
+        droplet_position[2] -= 0.0015
+        return droplet_position
+
+    # method to place droplets directly on the specimen by casting a ray straight down from the pipette tip
+    # a droplet whose ray hits the robot or misses the specimens is discarded, like a falling droplet hitting the robot
+    def _land_droplets(self, robotIds, droplet_positions):
+        ray_ends = [[x, y, 0] for x, y, _ in droplet_positions]
+        for robotId, hit in zip(robotIds, self._p.rayTestBatch(droplet_positions, ray_ends)):
+            hitId, hit_position = hit[0], hit[3]
+            if hitId in self.specimenIds:
+                # record the centre of the droplet resting on the surface, as a settled physics droplet would be
+                landing_position = (hit_position[0], hit_position[1], hit_position[2] + DROPLET_RADIUS)
+                self._record_droplet(hitId, robotId, landing_position)
+            elif hitId in self.robotIds:
+                # logged as removed where it hit, as _remove_droplet logs a falling droplet that touched a robot
+                self._record_droplet(-1, robotId, hit_position, DROPLET_REMOVED)
+
+    # method to track the final position of a droplet, on a specimen or where it hit a robot
+    def _record_droplet(self, specimenId, robotId, position, state=DROPLET_SETTLED):
+        self.droplet_log.append(specimenId, robotId, self.physics_step, position, state)
+
+    # dictionary of the settled droplet positions, key 'specimenId_<id>', value the list of droplet positions on that specimen
+    @property
+    def droplet_positions(self):
+        return self.droplet_log.as_dict(DROPLET_SETTLED)
+
     # method to get the states of the robots
     def get_states(self):
+        start = time.perf_counter_ns() if self.profiler else 0
         states = {}
         for robotId in self.robotIds:
-            raw_joint_states = p.getJointStates(robotId, [0, 1, 2])
+            raw_joint_states = self._p.getJointStates(robotId, [0, 1, 2])
 
             # Convert joint states into a dictionary
             joint_states = {}
@@ -314,7 +663,7 @@ class Simulation:
                 }
 
             # Robot position
-            robot_position = p.getBasePositionAndOrientation(robotId)[0]
+            robot_position = self._p.getBasePositionAndOrientation(robotId)[0]
             robot_position = list(robot_position)
 
             # Adjust robot position based on joint states
@@ -336,80 +685,178 @@ class Simulation:
                 "pipette_position": pipette_position
             }
 
+        if self.profiler:
+            self.profiler.lap('get_states', start)
         return states
     
+    # method to read the joint states of all robots into the preallocated arrays
+    # returns (joint positions, joint velocities, pipette positions), each of shape (N, 3)
+    # the arrays are overwritten on the next call, copy them if they need to be kept
+    def get_state_arrays(self):
+        start = time.perf_counter_ns() if self.profiler else 0
+        for i, robotId in enumerate(self.robotIds):
+            joint_states = self._p.getJointStates(robotId, JOINT_INDICES)
+            for j in range(3):
+                self.joint_position_array[i, j] = joint_states[j][0]
+                self.joint_velocity_array[i, j] = joint_states[j][1]
+
+        # pipette position = base position + pipette offset + signed joint positions
+        np.multiply(self.joint_position_array, JOINT_SIGNS, out=self.pipette_position_array)
+        self.pipette_position_array += self.pipette_origin_array
+
+        if self.profiler:
+            self.profiler.lap('get_state_arrays', start)
+        return self.joint_position_array, self.joint_velocity_array, self.pipette_position_array
+
+    # method to check contact of all falling droplets with the specimens and robots in a single sweep
+    # one contact query per falling droplet, settled and removed droplets are never queried again
+    def check_contacts(self):
+        if not self.falling_droplets:
+            return
+        specimenIds = set(self.specimenIds)
+        robotIds = set(self.robotIds)
+        for sphereId in list(self.falling_droplets):
+            contact_bodies = {contact[2] for contact in self._p.getContactPoints(bodyA=sphereId)}
+            touched_specimens = contact_bodies & specimenIds
+            # If contact with a specimen is detected the droplet is fixed in place
+            if touched_specimens:
+                self._settle_droplet(sphereId, min(touched_specimens))
+            # If contact with a robot is detected the droplet is destroyed
+            if contact_bodies & robotIds:
+                self._remove_droplet(sphereId)
+
     # method to check contact with the spheres and the specimen and robot, when contact is detected, the sphere is fixed in place and collision is disabled
+    # kept for single pair checks, run uses check_contacts to sweep all droplets at once
     def check_contact(self, robotId, specimenId):
-        for sphereId in self.sphereIds:
+        for sphereId in list(self.falling_droplets):
             # Check contact with the specimen
-            contact_points_specimen = p.getContactPoints(sphereId, specimenId)
+            contact_points_specimen = self._p.getContactPoints(sphereId, specimenId)
             # Check contact with the robot
-            contact_points_robot = p.getContactPoints(sphereId, robotId)
+            contact_points_robot = self._p.getContactPoints(sphereId, robotId)
 
             # If contact with the specimen is detected
             if contact_points_specimen:
-                #logging.info(f'sphereId: {sphereId}, in contact with specimen: {specimenId}')
-                # Disable collision between the sphere and the specimen
-                p.setCollisionFilterPair(sphereId, specimenId, -1, -1, enableCollision=0)
-                #logging.info(f'sphereId: {sphereId}, collision disabled')
-                # Get current position and orientation of the sphere
-                sphere_position, sphere_orientation = p.getBasePositionAndOrientation(sphereId)
-                # Fix the sphere in place relative to the world
-                p.createConstraint(parentBodyUniqueId=sphereId,
-                                    parentLinkIndex=-1,
-                                    childBodyUniqueId=-1,
-                                    childLinkIndex=-1,
-                                    jointType=p.JOINT_FIXED,
-                                    jointAxis=[0, 0, 0],
-                                    parentFramePosition=[0, 0, 0],
-                                    childFramePosition=sphere_position,
-                                    childFrameOrientation=sphere_orientation)
-                # track the final position of the sphere on the specimen by adding it to the dictionary
-                if f'specimenId_{specimenId}' in self.droplet_positions:
-                    self.droplet_positions[f'specimenId_{specimenId}'].append(sphere_position)
-                else:
-                    self.droplet_positions[f'specimenId_{specimenId}'] = [sphere_position]
-
-                #logging.info(f'sphereId: {sphereId}, fixed in place')
-
-                # # turn off all collisions with other spheres that are in contact with this sphere
-                # for sphereId2 in self.sphereIds:
-                #     if sphereId2 != sphereId:
-                #         contact_points = p.getContactPoints(sphereId, sphereId2)
-                #         if contact_points:
-                #             p.setCollisionFilterPair(sphereId, sphereId2, -1, -1, enableCollision=0)
-                #             logging.info(f'sphereId: {sphereId}, collision disabled with sphereId2: {sphereId2}')
+                self._settle_droplet(sphereId, specimenId)
 
             # If contact with the robot is detected
             if contact_points_robot:
-                # Destroy the sphere
-                p.removeBody(sphereId)
-                #logging.info(f'sphereId: {sphereId}, removed')
-                # Remove the sphereId from the list of sphereIds
-                self.sphereIds.remove(sphereId)
-                # Disable collision between the sphere and the robot
-                # p.setCollisionFilterPair(sphereId, robotId, -1, -1, enableCollision=0)
-                # Get current position and orientation of the sphere
-                # sphere_position, sphere_orientation = p.getBasePositionAndOrientation(sphereId)
-                # sphere_position = list(sphere_position)
-                # sphere_position[2] += 0.001
-                # # Fix the sphere in place relative to the world
-                # p.createConstraint(parentBodyUniqueId=sphereId,
-                #                     parentLinkIndex=-1,
-                #                     childBodyUniqueId=-1,
-                #                     childLinkIndex=-1,
-                #                     jointType=p.JOINT_FIXED,
-                #                     jointAxis=[0, 0, 0],
-                #                     parentFramePosition=[0, 0, 0],
-                #                     childFramePosition=sphere_position,
-                #                     childFrameOrientation=sphere_orientation)
-                                # turn off all collisions with other spheres that are in contact with this sphere
-                # for sphereId2 in self.sphereIds:
-                #     if sphereId2 != sphereId:
-                #         contact_points = p.getContactPoints(sphereId, sphereId2)
-                #         if contact_points:
-                #             p.setCollisionFilterPair(sphereId, sphereId2, -1, -1, enableCollision=0)
-                #             logging.info(f'sphereId: {sphereId}, collision disabled with sphereId2: {sphereId2}')
+                self._remove_droplet(sphereId)
+
+    # method to fix a falling droplet in place on a specimen and record its final position
+    def _settle_droplet(self, sphereId, specimenId):
+        # Get current position and orientation of the sphere
+        sphere_position, sphere_orientation = self._p.getBasePositionAndOrientation(sphereId)
+        self._constrain_droplet(sphereId, specimenId, sphere_position, sphere_orientation)
+        # track the final position of the sphere on the specimen in the droplet log
+        self._record_droplet(specimenId, self.falling_droplets[sphereId], sphere_position)
+
+        del self.falling_droplets[sphereId]
+        self.droplet_states[sphereId] = DROPLET_SETTLED
+
+    # method to fix a droplet in place on a specimen
+    def _constrain_droplet(self, sphereId, specimenId, sphere_position, sphere_orientation):
+        # Disable collision between the sphere and the specimen
+        self._p.setCollisionFilterPair(sphereId, specimenId, -1, -1, enableCollision=0)
+        # Fix the sphere in place relative to the world
+        constraintId = self._p.createConstraint(parentBodyUniqueId=sphereId,
+                            parentLinkIndex=-1,
+                            childBodyUniqueId=-1,
+                            childLinkIndex=-1,
+                            jointType=p.JOINT_FIXED,
+                            jointAxis=[0, 0, 0],
+                            parentFramePosition=[0, 0, 0],
+                            childFramePosition=sphere_position,
+                            childFrameOrientation=sphere_orientation)
+        self._droplet_constraints[sphereId] = (constraintId, specimenId)
+
+    # method to destroy a droplet, e.g. when it lands on the robot instead of the specimen, its body goes back to the pool
+    def _remove_droplet(self, sphereId):
+        if sphereId in self.falling_droplets:
+            sphere_position = self._p.getBasePositionAndOrientation(sphereId)[0]
+            self._record_droplet(-1, self.falling_droplets[sphereId], sphere_position, DROPLET_REMOVED)
+        self._release_droplet(sphereId)
+        self.sphereIds.remove(sphereId)
+        self.falling_droplets.pop(sphereId, None)
+        self.droplet_states[sphereId] = DROPLET_REMOVED
+
+    # method to capture the robots and droplets into a WorldState, e.g. to branch look-ahead rollouts from the current state
+    # with exact the state also keeps a pybullet saveState copy, which restores exactly in this process but costs about 1 MB
+    # and 14 ms per capture, it is freed by discard_state or when the state is garbage collected
+    def capture_state(self, exact=False):
+        joint_positions, joint_velocities, _ = self.get_state_arrays()
+        droplets = []
+        for sphereId in self.sphereIds:
+            position, orientation = self._p.getBasePositionAndOrientation(sphereId)
+            linear_velocity, angular_velocity = self._p.getBaseVelocity(sphereId)
+            specimenId = self._droplet_constraints[sphereId][1] if sphereId in self._droplet_constraints else None
+            droplets.append((sphereId, self.droplet_states[sphereId], self.falling_droplets.get(sphereId), specimenId,
+                             position, orientation, linear_velocity, angular_velocity))
+        state = WorldState(len(self.robotIds), self._generation, self.physics_step,
+                           joint_positions.copy(), joint_velocities.copy(), self._target_velocities.copy(),
+                           droplets, self.droplet_log.copy(), body_count=self._body_count())
+        if exact:
+            state.bullet_state_id = self._p.saveState()
+            state.client_id = self.physicsClient
+            state.bullet_finalizer = weakref.finalize(state, _remove_bullet_state, weakref.ref(self),
+                                                      self.physicsClient, state.bullet_state_id)
+        return state
+
+    # method to bring the robots and droplets back to a captured WorldState, the state can come from another process with the same world
+    def restore_state(self, state):
+        if state.num_agents != len(self.robotIds):
+            raise ValueError(f"state has {state.num_agents} agents, the simulation has {len(self.robotIds)}")
+        # Return the current spheres to the droplet pool
+        for sphereId in self.sphereIds:
+            self._release_droplet(sphereId)
+        self.sphereIds = []
+        self.droplet_states = {}
+        self.falling_droplets = {}
+
+        # the saved pybullet state is exact, but only fits while the world still has the same bodies
+        exact = (state.bullet_state_id is not None and state.client_id == self.physicsClient
+                 and state.generation == self._generation and state.body_count == self._body_count())
+        if exact:
+            # the same bodies, which are all back in the pool, play the same droplets
+            sphereBodies = [droplet[0] for droplet in state.droplets]
+            self._droplet_pool = [sphereBody for sphereBody in self._droplet_pool if sphereBody not in set(sphereBodies)]
+        else:
+            sphereBodies = self._acquire_droplet_bodies(len(state.droplets))
+        for sphereBody, droplet in zip(sphereBodies, state.droplets):
+            _, droplet_state, robotId, specimenId, position, orientation, linear_velocity, angular_velocity = droplet
+            self._launch_droplet(sphereBody, robotId, position)
+            if droplet_state == DROPLET_SETTLED:
+                self._constrain_droplet(sphereBody, specimenId, position, orientation)
+                del self.falling_droplets[sphereBody]
+                self.droplet_states[sphereBody] = DROPLET_SETTLED
+
+        if exact:
+            self._p.restoreState(state.bullet_state_id)
+        else:
+            for robotId, joint_positions, joint_velocities in zip(self.robotIds, state.joint_positions, state.joint_velocities):
+                for jointIndex in JOINT_INDICES:
+                    self._p.resetJointState(robotId, jointIndex, targetValue=joint_positions[jointIndex], targetVelocity=joint_velocities[jointIndex])
+            for sphereBody, droplet in zip(sphereBodies, state.droplets):
+                self._p.resetBasePositionAndOrientation(sphereBody, droplet[4], droplet[5])
+                self._p.resetBaseVelocity(sphereBody, droplet[6], droplet[7])
+
+        # neither restoreState nor resetJointState covers the motors
+        self._target_velocities[:] = state.target_velocities
+        for robotId, target_velocities in zip(self.robotIds, self._target_velocities):
+            self._p.setJointMotorControlArray(robotId, JOINT_INDICES, p.VELOCITY_CONTROL,
+                                              targetVelocities=target_velocities, forces=JOINT_FORCES)
+        self.droplet_log = state.droplet_log.copy()
+        self.physics_step = state.physics_step
+        # the last frame shows the world before the restore, even if it carries the same step number
+        self.frame_step = -1
+        return self.get_states()
+
+    # method to free the pybullet copy of a captured state, the state can still be restored the slower way
+    def discard_state(self, state):
+        if state.bullet_finalizer is not None:
+            # calling the finalizer removes the pybullet state once, it does not run again at garbage collection
+            state.bullet_finalizer()
+            state.bullet_finalizer = None
+        state.bullet_state_id = None
 
     def set_start_position(self, x, y, z):
         # Iterate through each robot and set its pipette to the start position
@@ -420,23 +867,49 @@ class Simulation:
             # You might need to adjust this based on the actual robot kinematics
 
             # Adjust the x, y, z values based on the robot's current position and pipette offset
-            robot_position = p.getBasePositionAndOrientation(robotId)[0]
+            robot_position = self._p.getBasePositionAndOrientation(robotId)[0]
             adjusted_x = x - robot_position[0] - self.pipette_offset[0]
             adjusted_y = y - robot_position[1] - self.pipette_offset[1]
             adjusted_z = z - robot_position[2] - self.pipette_offset[2]
 
             # Reset the joint positions/start position
-            p.resetJointState(robotId, 0, targetValue=adjusted_x)
-            p.resetJointState(robotId, 1, targetValue=adjusted_y)
-            p.resetJointState(robotId, 2, targetValue=adjusted_z)
-
-    # function to return the path of the current plate image
-    def get_plate_image(self):
-        return self.plate_image_path
+            self._p.resetJointState(robotId, 0, targetValue=adjusted_x)
+            self._p.resetJointState(robotId, 1, targetValue=adjusted_y)
+            self._p.resetJointState(robotId, 2, targetValue=adjusted_z)
+
+    # function to return the path of the current plate image, or of the plate on one specimen
+    def get_plate_image(self, specimenId=None):
+        if specimenId is None:
+            return self.plate_image_path
+        return self.textures.plate_image_path(self.specimen_plates[specimenId])
+
+    # method to swap the plate texture on live specimens, all of them by default, a random plate when plate_id is None
+    def set_plate(self, plate_id=None, specimenIds=None):
+        if plate_id is None:
+            plate_id = self.textures.random_plate()
+        textureId = self.textures.texture_id(plate_id)
+        if specimenIds is None:
+            specimenIds = self.specimenIds
+            # new specimens built by reset get this plate as well
+            self.plate_id = plate_id
+            self.textureId = textureId
+            self.plate_image_path = self.textures.plate_image_path(plate_id)
+        for specimenId in specimenIds:
+            self._p.changeVisualShape(specimenId, -1, textureUniqueId=textureId)
+            self.specimen_plates[specimenId] = plate_id
+        return plate_id
     
-    # close the simulation
+    # close the simulation, closing twice is a no-op
     def close(self):
-        p.disconnect()
+        if self.physicsClient >= 0:
+            self._p.disconnect()
+            self.physicsClient = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 
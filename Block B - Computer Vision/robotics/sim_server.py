@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+import numpy as np
+
+from sim_class import Simulation
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 31950  # the port of the OT-2 robot server
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SimServer:
+    """
+    Local asyncio HTTP/JSON stand-in for the OT-2 robot API, backed by one warm Simulation so that the
+    CV pipeline, the controllers and the benchmarks can share a simulator and measure real round trips.
+    Connections are kept alive and requests sent back to back on one connection (pipelining) are answered
+    in order. The simulation is only touched from the event loop, so requests never interleave.
+
+    GET  /state       -> the states dictionary of Simulation.get_states
+    POST /move        {"velocities": (N,3), "num_steps": 1} -> the states after moving without dropping
+    POST /drop        {"robots": [index, ...]} (all robots by default) -> the positions the droplets start from
+    POST /step_batch  {"actions": (T,N,4), "num_steps": 1} -> the (T,N,3) pipette positions after every action and the states
+    POST /reset       {"num_agents": N} -> the states of the rebuilt world
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, sim=None, **sim_kwargs):
+        self.host = host
+        self.port = port
+        self.sim = sim if sim is not None else Simulation(**{'render': False, **sim_kwargs})
+        self.routes = {
+            ('GET', '/state'): self.state,
+            ('POST', '/move'): self.move,
+            ('POST', '/drop'): self.drop,
+            ('POST', '/step_batch'): self.step_batch,
+            ('POST', '/reset'): self.reset,
+        }
+        self._server = None
+        # the handler task of every open connection, closed with the server
+        self._connections = set()
+
+    # method to turn a list of velocities or actions into an (N,width) array, one row for every robot
+    def _per_robot(self, values, width, name):
+        try:
+            values = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be numbers")
+        num_agents = len(self.sim.robotIds)
+        if values.shape[-2:] != (num_agents, width):
+            raise ValueError(f"{name} must have {num_agents} rows of {width} values, got shape {values.shape}")
+        return values
+
+    def state(self, body):
+        return self.sim.get_states()
+
+    def move(self, body):
+        velocities = self._per_robot(body.get('velocities'), 3, 'velocities')
+        actions = np.zeros((len(velocities), 4))
+        actions[:, :3] = velocities
+        self.sim.run_array(actions, int(body.get('num_steps', 1)))
+        return self.sim.get_states()
+
+    def drop(self, body):
+        indices = body.get('robots', range(len(self.sim.robotIds)))
+        try:
+            robotIds = [self.sim.robotIds[int(i)] for i in indices]
+        except (IndexError, TypeError, ValueError):
+            raise ValueError(f"robots must be indices below {len(self.sim.robotIds)}")
+        return {"droplet_positions": np.asarray(self.sim.drop_many(robotIds)).tolist()}
+
+    def step_batch(self, body):
+        actions = self._per_robot(body.get('actions'), 4, 'actions')
+        if actions.ndim != 3:
+            raise ValueError(f"actions must be a (steps, num_agents, 4) array, got shape {actions.shape}")
+        num_steps = int(body.get('num_steps', 1))
+        trajectory = np.empty((len(actions), len(self.sim.robotIds), 3))
+        for t, action in enumerate(actions):
+            trajectory[t] = self.sim.run_array(action, num_steps)[2]
+        return {"pipette_positions": trajectory.tolist(), "states": self.sim.get_states()}
+
+    def reset(self, body):
+        return self.sim.reset(num_agents=int(body.get('num_agents', len(self.sim.robotIds))))
+
+    # method to answer one request, returns the json response or raises HTTPError
+    def _dispatch(self, method, path, body):
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                raise HTTPError(405, f"{method} is not allowed on {path}")
+            raise HTTPError(404, f"no endpoint {path}")
+        try:
+            request = json.loads(body) if body else {}
+        except json.JSONDecodeError as error:
+            raise HTTPError(400, f"invalid json: {error}")
+        if not isinstance(request, dict):
+            raise HTTPError(400, "the request body must be a json object")
+        try:
+            return handler(request)
+        except (TypeError, ValueError) as error:
+            # e.g. {"num_steps": null} or a string where a number belongs
+            raise HTTPError(400, str(error))
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add((asyncio.current_task(), writer))
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                # without a valid length the next request on the connection can not be found, so it is closed after the answer
+                framed = False
+                try:
+                    try:
+                        length = int(headers.get('content-length', 0))
+                    except ValueError:
+                        raise HTTPError(400, f"invalid Content-Length {headers['content-length']!r}")
+                    if length < 0:
+                        raise HTTPError(400, f"invalid Content-Length {length}")
+                    if length > MAX_BODY_SIZE:
+                        raise HTTPError(413, f"the request body is larger than {MAX_BODY_SIZE} bytes")
+                    body = await reader.readexactly(length) if length else b''
+                    framed = True
+                    status, response = 200, self._dispatch(method, path.split('?')[0], body)
+                except HTTPError as error:
+                    status, response = error.status, {"error": str(error)}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    raise
+                except Exception as error:
+                    # any other failure still gets an answer, so pipelined requests behind it are not left waiting
+                    logging.exception(f"{method} {path} failed")
+                    status, response = 500, {"error": f"{type(error).__name__}: {error}"}
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1' and framed
+                payload = json.dumps(response).encode()
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                             + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard((asyncio.current_task(), writer))
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # closing a connection ends its handler at the next read
+            connections = list(self._connections)
+            for _, writer in connections:
+                writer.close()
+            await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        self.sim.close()
+
+
+class SimClient:
+    """
+    Asyncio client of SimServer, or of anything answering the same endpoints.
+    Keeps up to pool_size connections open and reuses them across requests, so concurrent callers
+    each get their own connection. pipeline sends several requests on one connection before reading
+    any response, which hides the round trip when the requests do not depend on each other.
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=4):
+        if pool_size < 1:
+            raise ValueError(f"pool_size must be at least 1, got {pool_size}")
+        self.host = host
+        self.port = port
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            return await asyncio.open_connection(self.host, self.port)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, reusable):
+        if reusable:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+        self._slots.release()
+
+    def _encode(self, method, path, body):
+        payload = json.dumps(body).encode() if body is not None else b''
+        return (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("the server closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        response = json.loads(await reader.readexactly(int(headers.get('content-length', 0))) or b'{}')
+        return status, response, headers.get('connection', '').lower() != 'close'
+
+    # method to send (method, path, body) requests back to back on one connection, returns the responses in order
+    # every response is read before an error response is raised, so the connection never goes back to the pool with answers pending
+    async def pipeline(self, requests):
+        reader, writer = connection = await self._acquire()
+        reusable = False
+        try:
+            writer.write(b''.join(self._encode(*request) for request in requests))
+            await writer.drain()
+            responses = []
+            error = None
+            keep_alive = True
+            for _ in requests:
+                status, response, keep_alive = await self._read_response(reader)
+                if status != 200 and error is None:
+                    error = RuntimeError(f"{status} {REASONS.get(status, '')}: {response.get('error')}")
+                responses.append(response)
+            # only reusable once every response has been read without the connection failing
+            reusable = keep_alive
+        finally:
+            self._release(connection, reusable)
+        if error is not None:
+            raise error
+        return responses
+
+    async def request(self, method, path, body=None):
+        return (await self.pipeline([(method, path, body)]))[0]
+
+    async def state(self):
+        return await self.request('GET', '/state')
+
+    async def move(self, velocities, num_steps=1):
+        return await self.request('POST', '/move', {"velocities": np.asarray(velocities).tolist(), "num_steps": num_steps})
+
+    async def drop(self, robots=None):
+        return (await self.request('POST', '/drop', {} if robots is None else {"robots": list(robots)}))["droplet_positions"]
+
+    async def step_batch(self, actions, num_steps=1):
+        response = await self.request('POST', '/step_batch', {"actions": np.asarray(actions).tolist(), "num_steps": num_steps})
+        return np.array(response["pipette_positions"]), response["states"]
+
+    async def reset(self, num_agents=None):
+        return await self.request('POST', '/reset', {} if num_agents is None else {"num_agents": num_agents})
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+            await writer.wait_closed()
+        self._idle = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+async def measure_latency(client, num_requests=1000, pipeline_depth=1):
+    """Returns the round trip times in milliseconds of num_requests /state requests, sent pipeline_depth at a time."""
+    latencies = []
+    for _ in range(num_requests // pipeline_depth):
+        start = time.perf_counter()
+        await client.pipeline([('GET', '/state', None)] * pipeline_depth)
+        latencies.extend([(time.perf_counter() - start) * 1000 / pipeline_depth] * pipeline_depth)
+    return np.array(latencies)
+
+
+async def _latency_report(args):
+    server = None
+    if not args.connect:
+        server = await SimServer(args.host, 0, num_agents=args.num_agents).start()
+    async with SimClient(args.host, server.port if server else args.port) as client:
+        await client.state()
+        print(f"--- Round trips to {client.host}:{client.port} ---")
+        for depth in (1, 8, 32):
+            latencies = await measure_latency(client, args.num_requests, depth)
+            print(f"pipeline depth {depth:>2}: mean {latencies.mean():.3f} ms, p50 {np.percentile(latencies, 50):.3f} ms, "
+                  f"p99 {np.percentile(latencies, 99):.3f} ms per request")
+        actions = np.zeros((100, args.num_agents, 4))
+        actions[:, :, 0] = 0.1
+        start = time.perf_counter()
+        for action in actions:
+            await client.move(action[:, :3])
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        await client.step_batch(actions)
+        batched = time.perf_counter() - start
+        print(f"100 control steps: {single * 1000:.1f} ms as /move requests, {batched * 1000:.1f} ms as one /step_batch")
+    if server:
+        await server.close()
+
+
+def main(args):
+    if args.latency:
+        asyncio.run(_latency_report(args))
+        return
+    server = SimServer(args.host, args.port, num_agents=args.num_agents)
+    print(f"Serving a simulation of {args.num_agents} robot(s) on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        server.sim.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--num_agents", type=int, default=1)
+    parser.add_argument("--latency", action="store_true", help="Measure round trip latencies instead of serving")
+    parser.add_argument("--connect", action="store_true", help="With --latency, measure a running server instead of starting one")
+    parser.add_argument("--num_requests", type=int, default=1000)
+    args = parser.parse_args()
+    main(args)
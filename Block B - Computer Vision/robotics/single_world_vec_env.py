@@ -0,0 +1,58 @@
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+from ot2_vector_env import OT2VectorEnv
+
+
+class SingleWorldVecEnv(VecEnv):
+    """
+    Stable-baselines3 VecEnv around OT2VectorEnv, which steps all robots in one PyBullet world in this process.
+    OT2VectorEnv is a gymnasium VectorEnv that SB3 does not accept directly, this adapter turns its
+    terminations and truncations into dones, its final_obs into terminal_observation and its truncations
+    into TimeLimit.truncated, the way SharedMemoryVecEnv reports them.
+    """
+    def __init__(self, num_envs, env_kwargs=None):
+        self.env = OT2VectorEnv(num_envs, **(env_kwargs or {}))
+        self._actions = None
+        super().__init__(num_envs, self.env.single_observation_space, self.env.single_action_space)
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions).reshape(self.num_envs, -1)
+
+    def step_wait(self):
+        observations, rewards, terminations, truncations, infos = self.env.step(self._actions)
+        dones = terminations | truncations
+        step_infos = []
+        for i in range(self.num_envs):
+            info = {"success": bool(infos["success"][i]),
+                    "TimeLimit.truncated": bool(truncations[i] and not terminations[i])}
+            if dones[i]:
+                info["terminal_observation"] = infos["final_obs"][i]
+            step_infos.append(info)
+        return observations, rewards.astype(np.float32), dones, step_infos
+
+    def reset(self):
+        # the robots share one world and one random generator, so only the first seed is used
+        observations, _ = self.env.reset(seed=self._seeds[0])
+        # Seeds and options are only used once
+        self._reset_seeds()
+        self._reset_options()
+        self.reset_infos = [{} for _ in range(self.num_envs)]
+        return observations
+
+    def close(self):
+        self.env.close()
+
+    # the attributes and methods belong to the one shared environment, every index gets the same one
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.env, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        result = getattr(self.env, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
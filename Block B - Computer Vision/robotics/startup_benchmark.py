@@ -0,0 +1,44 @@
+import argparse
+import time
+import numpy as np
+
+from sim_class import Simulation
+
+
+def measure_startup(num_agents, num_steps=24, texture_cache_dir=None):
+    """Builds a world with num_agents robots and returns the build, reset and per-step wall times in seconds."""
+    start = time.perf_counter()
+    sim = Simulation(num_agents=num_agents, render=False, texture_cache_dir=texture_cache_dir)
+    build_time = time.perf_counter() - start
+
+    actions = np.zeros((num_agents, 4))
+    actions[:, :3] = 0.1
+    start = time.perf_counter()
+    sim.run_array(actions, num_steps=num_steps)
+    step_time = (time.perf_counter() - start) / num_steps
+
+    start = time.perf_counter()
+    sim.reset(num_agents=num_agents)
+    reset_time = time.perf_counter() - start
+    sim.close()
+    return build_time, reset_time, step_time
+
+
+def main(args):
+    print("--- Simulation startup benchmark ---")
+    print(f"{'agents':>8} {'build (s)':>10} {'per robot (ms)':>15} {'reset (ms)':>11} {'step (ms)':>10}")
+    num_agents = 1
+    while num_agents <= args.max_agents:
+        build_time, reset_time, step_time = measure_startup(num_agents, args.num_steps, args.texture_cache_dir)
+        print(f"{num_agents:>8} {build_time:>10.3f} {build_time / num_agents * 1000:>15.2f} "
+              f"{reset_time * 1000:>11.2f} {step_time * 1000:>10.2f}")
+        num_agents *= 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max_agents", type=int, default=256, help="Largest grid, the benchmark doubles from 1 up to this")
+    parser.add_argument("--num_steps", type=int, default=24, help="Physics steps timed per grid")
+    parser.add_argument("--texture_cache_dir", type=str, default=None, help="Directory for the decoded texture copies, none to decode the pngs")
+    args = parser.parse_args()
+    main(args)
@@ -3,24 +3,12 @@ from sim_class import Simulation
 
 def move_until_stopped(sim, velocity_vector, max_duration=500):
     """Applies a velocity until the robot stops moving and returns the final state."""
-    action = [velocity_vector]
-    last_pos = None
-    
-    for _ in range(max_duration):
-        state = sim.run(action)
-        
-        # Dynamically get the robot's ID key
-        robot_key = list(state.keys())[0]
-        current_pos = state[robot_key]['pipette_position']
-        
-        # If the position is the same as the last step, we've stopped.
-        if current_pos == last_pos:
-            return state
-            
-        last_pos = current_pos
-        
+    # the simulation holds the velocity itself and stops once every joint is at rest
+    state, trajectory = sim.run_until([velocity_vector], velocity_epsilon=1e-3, max_steps=max_duration)
+
     # Failsafe in case it never stops
-    print("Warning: Max duration reached in move_until_stopped.")
+    if len(trajectory) == max_duration:
+        print("Warning: Max duration reached in move_until_stopped.")
     return state
 
 # --- Main Execution ---
@@ -32,22 +32,12 @@ for vector, name in corner_targets:
     sim.reset(num_agents=1)
 
     actions = [vector]
-    last_position = None
 
-    while True:
-        state = sim.run(actions)
-         # --- THE FINAL FIX ---
-        # Don't use a hard-coded key. Instead, get the first key from the dictionary.
-        robot_key = list(state.keys())[0] 
-        # Now use that dynamic key to get the position.
-        current_position = state[robot_key]['pipette_position']
-        # --- END OF FIX ---
-
-        if current_position == last_position:
-            break
-
-        last_position = current_position
-        print(f"Current Position: {last_position}", end='\r')
+    # Hold the vector until every joint has stopped against its limit
+    state, trajectory = sim.run_until(actions, velocity_epsilon=1e-3, max_steps=5000)
+    # Don't use a hard-coded key. Instead, get the first key from the dictionary.
+    robot_key = list(state.keys())[0]
+    last_position = state[robot_key]['pipette_position']
 
     # Store the final coordinates in our results dictionary
     working_envelope[name] = last_position
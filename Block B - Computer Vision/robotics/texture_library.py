@@ -0,0 +1,92 @@
+import hashlib
+import os
+import random
+
+# plate textures next to this file, with the matching plate images in textures/_plates
+TEXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'textures')
+PLATE_IMAGE_DIR = '_plates'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def _image_files(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, name)))
+
+
+class PlateTextureLibrary:
+    """
+    The plate textures of a Simulation, found relative to this module instead of the working directory.
+    Plate id k is the k-th texture in sorted order and maps to the k-th image in sorted order in
+    textures/_plates. Each texture is loaded into the physics client once, on first use or all at
+    once with preload, and random plates come from the library's own seeded generator.
+    With a cache_dir the textures are loaded from uncompressed copies kept there, decoding the png
+    is the largest single cost of building a world and the copies are shared by every process.
+    """
+    def __init__(self, client, texture_dir=TEXTURE_DIR, seed=None, preload=False, cache_dir=None):
+        self._p = client
+        self.cache_dir = cache_dir
+        self.texture_paths = [os.path.join(texture_dir, name) for name in _image_files(texture_dir)]
+        if not self.texture_paths:
+            raise ValueError(f"no plate textures found in {texture_dir}")
+        plate_dir = os.path.join(texture_dir, PLATE_IMAGE_DIR)
+        plate_images = [os.path.join(plate_dir, name) for name in _image_files(plate_dir)]
+        # a texture without a plate image has no image for the computer vision pipeline
+        self.plate_image_paths = plate_images[:len(self.texture_paths)] + [None] * (len(self.texture_paths) - len(plate_images))
+        self._textureIds = {}
+        self.rng = random.Random(seed)
+        if preload:
+            self.preload()
+
+    def __len__(self):
+        return len(self.texture_paths)
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    # method to load every texture into the client now instead of on first use
+    def preload(self):
+        for plate_id in range(len(self)):
+            self.texture_id(plate_id)
+
+    # method to get the pybullet texture id of a plate, loading it the first time
+    def texture_id(self, plate_id):
+        self._check(plate_id)
+        if plate_id not in self._textureIds:
+            path = self.texture_paths[plate_id]
+            if self.cache_dir is not None:
+                path = self._cached_texture(path)
+            self._textureIds[plate_id] = self._p.loadTexture(path)
+        return self._textureIds[plate_id]
+
+    # method to get the uncompressed copy of a texture in the cache, written the first time
+    def _cached_texture(self, path):
+        with open(path, 'rb') as file:
+            # keyed by content, an edited texture gets a new copy
+            key = hashlib.sha1(file.read()).hexdigest()
+        cached_path = os.path.join(self.cache_dir, key + '.bmp')
+        if not os.path.exists(cached_path):
+            import cv2
+            image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            # pybullet only reads 8 bit bmp files without alpha, the renderer ignores the alpha of a texture anyway,
+            # a file cv2 cannot read or convert is handed to pybullet as it is
+            if image is None or image.dtype != 'uint8':
+                return path
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # written under a name of its own and renamed, so processes building at the same time never read half a file
+            temporary_path = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.bmp')
+            cv2.imwrite(temporary_path, image[:, :, :3] if image.ndim == 3 else image)
+            os.replace(temporary_path, cached_path)
+        return cached_path
+
+    def plate_image_path(self, plate_id):
+        self._check(plate_id)
+        return self.plate_image_paths[plate_id]
+
+    def random_plate(self):
+        return self.rng.randrange(len(self))
+
+    def _check(self, plate_id):
+        if not 0 <= plate_id < len(self):
+            raise ValueError(f"plate_id must be in [0, {len(self)}), got {plate_id}")
@@ -1,6 +1,7 @@
 import gymnasium as gym
 from stable_baselines3 import PPO
 from stable_baselines3.common.callbacks import CheckpointCallback
+from stable_baselines3.common.vec_env import VecMonitor
 from wandb.integration.sb3 import WandbCallback
 import wandb
 import os
@@ -8,6 +9,8 @@ import argparse
 
 # Use the environment wrapper that supports custom rewards
 from ot2_gym_wrapper_2 import OT2Env
+from shm_vec_env import SharedMemoryVecEnv
+from single_world_vec_env import SingleWorldVecEnv
 
 def main(args):
     """
@@ -35,12 +38,32 @@ def main(args):
 
     # --- Environment Initialization ---
     # Pass the reward parameters from the arguments directly to the environment
-    env = OT2Env(
+    env_kwargs = dict(
         threshold=args.threshold,
         reward_distance_scale=args.reward_distance_scale,
         step_penalty=args.step_penalty,
-        bonus_reward=args.bonus_reward
+        bonus_reward=args.bonus_reward,
+        action_repeat=args.action_repeat,
+        physics_preset=args.physics_preset,
+        reset_mode=args.reset_mode,
+        num_targets=args.num_targets,
+        backend=args.backend
     )
+    if args.single_world:
+        # All robots in one PyBullet world in this process, OT2VectorEnv has no goal-only or multi-target episodes
+        if args.reset_mode != "full" or args.num_targets != 1:
+            raise ValueError("--single_world supports neither --reset_mode goal nor --num_targets above 1")
+        if args.backend != "pybullet":
+            raise ValueError("--single_world only runs on the pybullet backend")
+        env_kwargs.pop("reset_mode")
+        env_kwargs.pop("num_targets")
+        env_kwargs.pop("backend")
+        env = VecMonitor(SingleWorldVecEnv(args.num_envs, env_kwargs=env_kwargs))
+    elif args.num_envs > 1:
+        # One worker process per environment, stepping in parallel on separate cores
+        env = VecMonitor(SharedMemoryVecEnv(args.num_envs, env_kwargs=env_kwargs))
+    else:
+        env = OT2Env(**env_kwargs)
 
     # --- Callbacks ---
     checkpoint_callback = CheckpointCallback(
@@ -84,8 +107,16 @@ def main(args):
     except KeyboardInterrupt:
         print("\n--- Training Interrupted by User ---")
     finally:
-        env.close()
-        run.finish()
+        try:
+            # only the worker processes of SharedMemoryVecEnv keep step rates
+            if isinstance(getattr(env, "venv", None), SharedMemoryVecEnv):
+                rates = env.venv.worker_step_rates()
+                print(f"Worker step rates (steps/s): {rates['steps_per_second'].round(1)}")
+        finally:
+            try:
+                env.close()
+            finally:
+                run.finish()
 
 if __name__ == '__main__':
     # --- Argument Parsing ---
@@ -101,6 +132,13 @@ if __name__ == '__main__':
     parser.add_argument("--gae_lambda", type=float, default=0.92)
     parser.add_argument("--clip_range", type=float, default=0.25)
     parser.add_argument("--hidden_units", type=int, default=128)
+    parser.add_argument("--num_envs", type=int, default=1, help="Number of environments stepped in parallel worker processes")
+    parser.add_argument("--single_world", action="store_true", help="Step the num_envs robots in one PyBullet world in this process instead of worker processes")
+    parser.add_argument("--action_repeat", type=int, default=1, help="Physics steps per environment step")
+    parser.add_argument("--physics_preset", type=str, default="balanced", choices=["fast", "balanced", "accurate"], help="Solver settings of the simulation")
+    parser.add_argument("--backend", type=str, default="pybullet", choices=["pybullet", "kinematic"], help="Simulate the robot with PyBullet or the kinematic NumPy model")
+    parser.add_argument("--reset_mode", type=str, default="full", choices=["full", "goal"], help="Restore the world on reset, or only draw a new goal")
+    parser.add_argument("--num_targets", type=int, default=1, help="Goals chained within one episode")
     
     # Environment Reward Hyperparameters
     parser.add_argument("--threshold", type=float, default=0.001, help="Success threshold in meters")
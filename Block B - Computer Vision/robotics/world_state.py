@@ -0,0 +1,35 @@
+class WorldState:
+    """
+    Handle to a Simulation state, returned by Simulation.capture_state and taken by restore_state.
+    It holds the joint positions, velocities and motor targets of every robot and the pose, velocity
+    and lifecycle state of every droplet, so it can be pickled and restored in another process that
+    built the same world. Captured with exact=True, the handle also keeps a pybullet saveState id in the
+    capturing process, which restores the world exactly as long as no droplet bodies were added in the
+    meantime. That copy is freed by Simulation.discard_state or when the handle is garbage collected.
+    """
+    def __init__(self, num_agents, generation, physics_step, joint_positions, joint_velocities, target_velocities,
+                 droplets, droplet_log, bullet_state_id=None, client_id=None, body_count=None):
+        self.num_agents = num_agents
+        # the Simulation counts the worlds it builds, a state only fits the world it was captured from
+        self.generation = generation
+        self.physics_step = physics_step
+        self.joint_positions = joint_positions
+        self.joint_velocities = joint_velocities
+        self.target_velocities = target_velocities
+        # (sphereId, droplet state, robotId of a falling droplet, specimenId of a settled droplet,
+        #  position, orientation, linear velocity, angular velocity) per droplet
+        self.droplets = droplets
+        self.droplet_log = droplet_log
+        self.bullet_state_id = bullet_state_id
+        self.client_id = client_id
+        self.body_count = body_count
+        # weakref.finalize that removes the pybullet state, set by Simulation.capture_state(exact=True)
+        self.bullet_finalizer = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # a pybullet state id only means something to the client that saved it
+        state['bullet_state_id'] = None
+        state['client_id'] = None
+        state['bullet_finalizer'] = None
+        return state